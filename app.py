@@ -1,10 +1,39 @@
 import streamlit as st
-from utils.auth import login, logout
+from utils.auth import (
+    LoginRejected,
+    SessionSecretError,
+    check_session,
+    check_session_secret,
+    login,
+    logout,
+    sync_session_cookie,
+)
+from utils.data_loader import refresh_data, schema_issues
+from utils.perf import (
+    cache_report,
+    memory_tracing,
+    prometheus_text,
+    reset,
+    set_memory_tracing,
+    span_report,
+    table_memory_report,
+    write_metrics_file,
+)
+from utils.schema import SchemaError
 
 st.set_page_config(initial_sidebar_state="collapsed")
 
-if "authenticated" not in st.session_state:
-    st.session_state.authenticated = False
+# Sessions cannot be signed with a bad SESSION_SECRET, say so instead of
+# failing on the first login
+try:
+    check_session_secret()
+except SessionSecretError as e:
+    st.error(str(e))
+    st.stop()
+
+# Restores the session from its cookie after a refresh or in a new tab
+st.session_state.authenticated = check_session()
+sync_session_cookie()
 
 
 # ---------------- LOGIN SCREEN ----------------
@@ -40,10 +69,13 @@ if not st.session_state.authenticated:
             submitted = st.form_submit_button("Login")
 
             if submitted:
-                if login(username, password):
-                    st.rerun()
-                else:
-                    st.error("Invalid credentials")
+                try:
+                    if login(username, password):
+                        st.rerun()
+                    else:
+                        st.error("Invalid credentials")
+                except LoginRejected as e:
+                    st.error(str(e))
     st.stop()
 
 
@@ -57,6 +89,42 @@ if st.sidebar.button("Logout"):
     logout()
     st.rerun()
 
+if st.session_state.role == "admin":
+    if st.sidebar.button("Refresh Data"):
+        refresh_data(incremental=True)
+        st.rerun()
+    if st.sidebar.button("Full Reload"):
+        refresh_data()
+        st.rerun()
+
+    issues = schema_issues()
+    if issues:
+        with st.sidebar.expander(f"⚠️ Schema issues ({len(issues)})"):
+            st.dataframe(issues, hide_index=True)
+
+    # Figures up to the previous run of the app
+    with st.sidebar.expander("⏱️ Performance"):
+        trace = st.checkbox(
+            "Trace memory",
+            value=memory_tracing(),
+            help="Peak memory per span (tracemalloc), slows the app down"
+        )
+        set_memory_tracing(trace)
+
+        st.dataframe(span_report(), hide_index=True)
+        st.dataframe(cache_report(), hide_index=True)
+        # Raw vs compacted size of the fact tables, from their last read
+        st.dataframe(table_memory_report(), hide_index=True)
+        st.download_button(
+            "Prometheus metrics",
+            prometheus_text(),
+            file_name="oee_metrics.prom",
+            mime="text/plain"
+        )
+        if st.button("Reset metrics"):
+            reset()
+            st.rerun()
+
 
 # Role-based navigation
 role = st.session_state.role
@@ -97,4 +165,11 @@ elif role == "viewer":
     }
 
 pg = st.navigation(pages)
-pg.run()
\ No newline at end of file
+
+try:
+    pg.run()
+except SchemaError as e:
+    st.error("The production data does not match the expected schema.")
+    st.dataframe(e.issues, hide_index=True)
+
+write_metrics_file()
\ No newline at end of file
@@ -0,0 +1,166 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+from streamlit.logger import set_log_level
+
+from benchmarks.synthetic import generate_tables, write_database
+
+# Wall time and peak traced memory per pipeline stage on synthetic data,
+# compared against the stored baselines:
+#   python -m benchmarks.run --entries 10000 100000 [--update-baseline]
+BASELINE_FILE = Path(__file__).with_name("baselines.json")
+
+# Dimensions the pages aggregate by
+PAGE_DIMS = [["month"], ["machine"], ["Machine"], ["Operator"], ["Incident"], ["day"]]
+
+# Differences below these are noise, whatever the ratio
+MIN_SECONDS = 0.05
+MIN_MB = 1.0
+
+
+def _measure(func, repeat):
+    # Best of `repeat` untraced runs for the time, one traced run for memory
+    seconds = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        seconds = elapsed if seconds is None else min(seconds, elapsed)
+
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return result, {"seconds": round(seconds, 4), "peak_mb": round(peak / 2**20, 2)}
+
+
+def run_stages(repeat=1):
+    from utils import data_loader as dl
+
+    def load_data():
+        dl.load_data.clear()
+        return dl.load_data()
+
+    def sql_aggregations():
+        dl.calculate_oee_grouped_sql.clear()
+        dl.calculate_oee_sql.clear()
+        dl.calculate_oee_sql()
+        return [dl.calculate_oee_grouped_sql(dims) for dims in PAGE_DIMS]
+
+    results = {}
+    tables, results["load_data"] = _measure(load_data, repeat)
+    model, results["build_model"] = _measure(lambda: dl.build_model(tables), repeat)
+    cube, results["build_cube"] = _measure(lambda: dl.build_cube(model), repeat)
+    _, results["calculate_oee"] = _measure(lambda: dl.calculate_oee(model), repeat)
+    _, results["aggregations_model"] = _measure(
+        lambda: [dl.calculate_oee_grouped(model, dims) for dims in PAGE_DIMS], repeat
+    )
+    _, results["aggregations_cube"] = _measure(
+        lambda: [dl.calculate_oee(cube)] +
+        [dl.calculate_oee_grouped(cube, dims) for dims in PAGE_DIMS],
+        repeat
+    )
+    _, results["build_bucket_cubes"] = _measure(
+        lambda: [dl.build_bucket_cube(model, kind) for kind in ("hour", "shift", "day")],
+        repeat
+    )
+    _, results["aggregations_sql"] = _measure(sql_aggregations, repeat)
+
+    return results
+
+
+def compare(results, baseline, tolerance, memory_tolerance):
+    # Stage names that got slower or hungrier than the baseline allows
+    regressions = []
+    for stage, current in results.items():
+        reference = baseline.get(stage)
+        if reference is None:
+            continue
+        slower = (
+            current["seconds"] > reference["seconds"] * (1 + tolerance) and
+            current["seconds"] - reference["seconds"] > MIN_SECONDS
+        )
+        bigger = (
+            current["peak_mb"] > reference["peak_mb"] * (1 + memory_tolerance) and
+            current["peak_mb"] - reference["peak_mb"] > MIN_MB
+        )
+        if slower or bigger:
+            regressions.append(stage)
+    return regressions
+
+
+def _report(entries, results, baseline, regressions):
+    print(f"\n{entries:,} entries")
+    print(f"{'stage':<20}{'seconds':>10}{'base':>10}{'peak MB':>10}{'base':>10}")
+    for stage, current in results.items():
+        reference = baseline.get(stage, {})
+        flag = "  REGRESSION" if stage in regressions else ""
+        print(
+            f"{stage:<20}{current['seconds']:>10.3f}"
+            f"{reference.get('seconds', float('nan')):>10.3f}"
+            f"{current['peak_mb']:>10.1f}"
+            f"{reference.get('peak_mb', float('nan')):>10.1f}{flag}"
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="OEE data pipeline benchmarks")
+    parser.add_argument("--entries", type=int, nargs="+", default=[10_000])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--database-url",
+        help="Database to write the synthetic tables to (default: a temporary SQLite file)"
+    )
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--memory-tolerance", type=float, default=0.10)
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args(argv)
+
+    from utils import data_loader as dl
+
+    # Cached functions warn when called outside `streamlit run`
+    set_log_level("error")
+
+    baselines = {}
+    if BASELINE_FILE.exists():
+        baselines = json.loads(BASELINE_FILE.read_text())
+
+    failed = False
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for entries in args.entries:
+            url = args.database_url or f"sqlite:///{tmp_dir}/benchmark_{entries}.db"
+            write_database(generate_tables(entries, seed=args.seed), url)
+
+            os.environ["DATABASE_URL"] = url
+            dl.get_engine.clear()
+
+            results = run_stages(args.repeat)
+            dl.get_engine().dispose()
+
+            key = str(entries)
+            baseline = baselines.get(key, {})
+            regressions = compare(results, baseline, args.tolerance, args.memory_tolerance)
+            _report(entries, results, baseline, regressions)
+            failed = failed or bool(regressions)
+
+            if args.update_baseline:
+                baselines[key] = results
+
+    if args.update_baseline:
+        BASELINE_FILE.write_text(json.dumps(baselines, indent=2, sort_keys=True) + "\n")
+        print(f"\nBaselines written to {BASELINE_FILE}")
+        return 0
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,102 @@
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine
+
+from utils.sql import TIMESTAMP_FORMAT
+
+# Schema-compatible stand-ins for the production tables, sized by the
+# number of entries. Entries are stored like in the database: StartTime and
+# EndTime as dd-mm-yyyy text.
+
+
+def _labels(prefix, count):
+    return [f"{prefix} {i:05d}" for i in range(count)]
+
+
+def generate_tables(entries=10_000, seed=0, start="2015-01-01"):
+    rng = np.random.default_rng(seed)
+
+    machines = int(np.clip(entries // 2_000, 20, 500))
+    operators = int(np.clip(entries // 500, 50, 2_000))
+    products = int(np.clip(entries // 100, 100, 5_000))
+    orders = max(entries // 4, 1)
+
+    dMachine = pd.DataFrame({
+        "MachineID": [f"M-{i:04d}" for i in range(machines)],
+        "Machine": _labels("MACHINE", machines),
+    })
+
+    dOperator = pd.DataFrame({
+        "OperatorID": np.arange(1, operators + 1),
+        "Operator": _labels("Operator", operators),
+    })
+
+    dIncident = pd.DataFrame({
+        "IncidentID": np.arange(1, 26),
+        "Incident": _labels("Incident", 25),
+        "Type": np.where(np.arange(25) < 5, "Reject", "Stop"),
+    })
+
+    dProduct = pd.DataFrame({
+        "ProductID": [f"P{i:06d}" for i in range(products)],
+        "Description": _labels("PRODUCT", products),
+        "ItemsPerHour": rng.uniform(50, 25_000, products).round(),
+    })
+
+    # Orders and their entries spread over ~4 entries per order, about
+    # 40 entries per hour across the plant
+    first_po = 10_000
+    span_seconds = max(entries * 90, 86_400)
+    issue = pd.Timestamp(start) + pd.to_timedelta(
+        np.sort(rng.integers(0, span_seconds, orders)), unit="s"
+    )
+    fProductionOrders = pd.DataFrame({
+        "PO_ID": np.arange(first_po, first_po + orders),
+        "IssueDate": issue.normalize(),
+        "PlannedDeliveryDate": issue.normalize() + pd.Timedelta(days=14),
+        "ProductID": dProduct["ProductID"].to_numpy()[rng.integers(0, products, orders)],
+        "QtyOrdered": rng.integers(10, 5_000, orders),
+    })
+
+    order_index = np.minimum(np.arange(entries) // 4, orders - 1)
+    start_time = issue[order_index] + pd.to_timedelta(
+        rng.integers(0, 3_600, entries), unit="s"
+    )
+    duration = pd.to_timedelta(rng.integers(60, 4 * 3_600, entries), unit="s")
+    outage = rng.random(entries) < 0.3
+    hours = duration.total_seconds().to_numpy() / 3_600
+    items_per_hour = dProduct.set_index("ProductID")["ItemsPerHour"].reindex(
+        fProductionOrders["ProductID"].to_numpy()[order_index]
+    ).to_numpy()
+
+    machine_id = dMachine["MachineID"].to_numpy()[rng.integers(0, machines, entries)].astype(object)
+    machine_id[rng.random(entries) < 0.01] = None
+
+    fProductionEntries = pd.DataFrame({
+        "PO_ID": fProductionOrders["PO_ID"].to_numpy()[order_index],
+        "OperatorID": rng.integers(1, operators + 1, entries),
+        "IncidentID": np.where(outage, rng.integers(1, 26, entries), np.nan),
+        "MachineID": machine_id,
+        "StartTime": start_time.strftime(TIMESTAMP_FORMAT),
+        "EndTime": (start_time + duration).strftime(TIMESTAMP_FORMAT),
+        "QtyProduced": np.where(
+            outage, 0, (items_per_hour * hours * rng.uniform(0.6, 1.05, entries)).round()
+        ),
+        "QtyRejected": np.where(outage, 0, rng.poisson(0.5, entries)),
+    })
+
+    return {
+        "dProduct": dProduct,
+        "dMachine": dMachine,
+        "dOperator": dOperator,
+        "dIncident": dIncident,
+        "fProductionOrders": fProductionOrders,
+        "fProductionEntries": fProductionEntries,
+    }
+
+
+def write_database(tables, url):
+    engine = create_engine(url)
+    for name, df in tables.items():
+        df.to_sql(name, engine, if_exists="replace", index=False, chunksize=50_000)
+    engine.dispose()
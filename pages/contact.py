@@ -1,18 +1,12 @@
 import streamlit as st
-import smtplib
-import random
-import os
-import time
 import datetime
 
 from email_validator import validate_email, EmailNotValidError
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from captcha.image import ImageCaptcha
 from io import BytesIO
 from PIL import Image
-from streamlit_js_eval import streamlit_js_eval
 from utils.auth import require_role
+from utils.captcha_pool import captcha_expired, take_captcha
+from utils.mailer import FINAL_STATUSES, compose, mail_status, send_mail, smtp_settings
 require_role(["admin", "manager", "analyst", "viewer"])
 
 ## Page configuration options
@@ -20,26 +14,56 @@ st.set_page_config(page_title="✉️ Send Email",layout="wide")  # column width
 
 ## Load secrets.toml variables
 options = st.secrets["OPTIONS"]
-server = st.secrets["SERVER"]
-port = st.secrets["PORT"]
-sender = os.getenv("SENDER")
-secret = os.getenv("PY_NEWS")
 # recipient = os.getenv("RECIPIENT")
 
 
 ## Functions
 def generate_captcha():
-    captcha_text = "".join(random.choices(options,
-                                          k=6))  # options is a string of characters that can be included in the CAPTCHA. It may be as simple or as complex as you wish.
-    image = ImageCaptcha(width=400, height=100).generate(captcha_text)
-    return captcha_text, image
+    # (text, image, expiry) from the shared pool of pre-rendered CAPTCHAs.
+    # options is a string of characters that can be included in the CAPTCHA. It may be as simple or as complex as you wish.
+    return take_captcha(options)
+
+
+def render_mail_status(job_id):
+    status = mail_status(job_id)
+    if status is None:
+        return
+    if status["status"] in FINAL_STATUSES:
+        # Shown once, not on every later visit in the session
+        del st.session_state.mail_job
+    if status["status"] == "sent":
+        st.success("Sent successfully!")  # Success message to the user.
+    elif status["status"] == "invalid":
+        st.error(f"Invalid email address. {status['error']}")
+    elif status["status"] == "failed":
+        st.error(f"The email could not be sent. {status['error']}")
+    else:
+        _poll_mail_status(job_id)
+
+
+@st.fragment(run_every=1)
+def _poll_mail_status(job_id):
+    # Only this fragment reruns while the worker is busy; the whole page
+    # once more when the job is done
+    status = mail_status(job_id)
+    if status is None or status["status"] in FINAL_STATUSES:
+        st.rerun()
+    if status["status"] == "retrying":
+        st.warning(f"Mail server unavailable, retrying (attempt {status['attempts']})...")
+    else:
+        st.info("Sending...")
 
 
 ## Generate CAPTCHA
 if 'captcha_text' not in st.session_state:
     st.session_state.captcha_text = generate_captcha()
 
-captcha_text, captcha_image = st.session_state.captcha_text
+captcha_text, captcha_image, _ = st.session_state.captcha_text
+
+## Clear the form after a message was queued
+if st.session_state.pop("contact_sent", False):
+    st.session_state.email = ""
+    st.session_state.message = ""
 
 ## Contact Form
 st.header("✉️ Internal Contact", anchor=False)
@@ -60,7 +84,7 @@ with col3:  # right side of the layout
     if st.button("Refresh", type="secondary",
                  use_container_width=True):  # option to refresh CAPTCHA without refreshing the page
         st.session_state.captcha_text = generate_captcha()
-        captcha_text, captcha_image = st.session_state.captcha_text
+        captcha_text, captcha_image, _ = st.session_state.captcha_text
         captcha_placeholder.image(captcha_image, width='stretch')
 
     captcha_input = st.text_input("Enter the CAPTCHA")  # box to insert CAPTCHA
@@ -83,60 +107,43 @@ with col1:  # left side of the layout
             st.error("Please fill out all required fields.")  # error for any blank field
         else:
             try:
-                # Robust email validation
-                valid = validate_email(email, check_deliverability=True)
-
-                # Check CAPTCHA
-                if captcha_input.upper() == captcha_text:
+                # Syntax only here, the deliverability (DNS) check runs in
+                # the mail worker
+                validate_email(email, check_deliverability=False)
 
-                    smtp_server = server
-                    smtp_port = port
-                    smtp_username = sender
-                    smtp_password = secret
-                    recipient_email = email
+                # Check CAPTCHA, each one is single-use
+                expired = captcha_expired(st.session_state.captcha_text)
+                matches = captcha_input.upper() == captcha_text
+                st.session_state.captcha_text = generate_captcha()
+                captcha_placeholder.image(st.session_state.captcha_text[1], width='stretch')
 
-                    # Create an SMTP connection
-                    server = smtplib.SMTP(smtp_server, smtp_port)
-                    server.starttls()
-                    server.login(smtp_username, smtp_password)
+                if expired:
+                    st.error("The CAPTCHA expired, please enter the new one.")
+                elif matches:
 
                     # Compose the email message
                     subject = "Contact Form Submission" # subject of the email you will receive upon contact.
                     body = f"Email: {email}\nMessage: {message}"
-                    msg = MIMEMultipart()
-                    msg['From'] = smtp_username
-                    msg['To'] = recipient_email
-                    msg['Subject'] = subject
-                    msg.attach(MIMEText(body, 'plain'))
-
-                    # Send the email
-                    server.sendmail(smtp_username, recipient_email, msg.as_string())
 
-                    # Send the confirmation email to the message sender # If you do not want to send a confirmation email leave this section commented
+                    # Confirmation email to the message sender # If you do not want to send a confirmation email leave it out of the list
                     current_datetime = datetime.datetime.now()
                     formatted_datetime = current_datetime.strftime("%Y-%m-%d %H:%M:%S")
                     confirmation_subject = f"Confirmation of Internal Contact Submission ({formatted_datetime})"
                     confirmation_body = f"Your message has been received.\n\nYour message: {message}"
-                    confirmation_msg = MIMEMultipart()
-                    confirmation_msg['From'] = smtp_username
-                    confirmation_msg['To'] = email  # Use the recipient email address here
-                    confirmation_msg['Subject'] = confirmation_subject
-                    confirmation_msg.attach(MIMEText(confirmation_body, 'plain'))
-                    server.sendmail(smtp_username, email, confirmation_msg.as_string())
-
-                    # Close the SMTP server connection
-                    server.quit()
-
-                    st.success("Sent successfully!") # Success message to the user.
 
-                    # Generate a new captcha to prevent button spamming.
-                    st.session_state.captcha_text = generate_captcha()
-                    captcha_text, captcha_image = st.session_state.captcha_text
-                    # Update the displayed captcha image
-                    captcha_placeholder.image(captcha_image, width='stretch')
+                    settings = smtp_settings()
+                    smtp_username = settings["username"]
+                    st.session_state.mail_job = send_mail(
+                        [
+                            compose(smtp_username, email, subject, body),
+                            compose(smtp_username, email, confirmation_subject, confirmation_body),
+                        ],
+                        settings,
+                        check_address=email
+                    )
 
-                    time.sleep(3)
-                    streamlit_js_eval(js_expressions="parent.window.location.reload()")
+                    st.session_state.contact_sent = True
+                    st.rerun()
 
                 else:
                     st.error(
@@ -146,3 +153,5 @@ with col1:  # left side of the layout
                 st.error(
                     f"Invalid email address. {e}")  # error in case any of the email validation checks have not passed
 
+    if "mail_job" in st.session_state:
+        render_mail_status(st.session_state.mail_job)
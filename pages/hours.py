@@ -1,41 +1,37 @@
 import streamlit as st
-from utils.data_loader import load_data, build_model, calculate_oee
+from utils.data_loader import (
+    kpi_backend,
+    load_filtered_cube,
+    oee_grouped,
+    oee_totals,
+)
 import plotly.express as px
-import pandas as pd
 from utils.auth import require_role
+from utils.charts import downsample
+from utils.figure_cache import cached_figure
+from utils.filters import render_filters
+from utils.perf import plotly_chart
 require_role(["admin", "manager", "viewer"])
 
 st.set_page_config(page_title="⏳ Hours",layout="wide")
 
-def calculate_availa_over_time(df):
-
-    monthly = []
-
-    grouped = df.groupby(["MonthLabel", "MonthSort"])
-
-    for (label, sort), group in grouped:
-        metrics = calculate_oee(group)
-
-        monthly.append({
-            "MonthLabel": label,
-            "MonthSort": sort,
-            "Availability": metrics["availability"]
-        })
+def calculate_availa_over_time(df, selection=None):
 
-    monthly_df = pd.DataFrame(monthly)
+    monthly_df = oee_grouped(df, ["month"], selection)
+    monthly_df = monthly_df.rename(columns={"availability": "Availability"})
+    monthly_df = monthly_df[["MonthLabel", "MonthSort", "Availability"]]
     monthly_df = monthly_df.sort_values("MonthSort")
 
     return monthly_df
 
 
-def render_hours_by_incident(df):
-
-    df_incidents = df[df["IncidentID"].notna()]
+def build_hours_by_incident(df, selection=None):
 
+    # Productive entries have no incident, only outage hours are left
     incident_hours = (
-        df_incidents
-        .groupby("Incident", as_index=False)["Hours"]
-        .sum()
+        oee_grouped(df, ["Incident"], selection)
+        .rename(columns={"outage_hours": "Hours"})
+        [["Incident", "Hours"]]
         .sort_values("Hours", ascending=True)
     )
 
@@ -54,21 +50,23 @@ def render_hours_by_incident(df):
         title="Outage Hours by Incident"
     )
 
-    st.plotly_chart(fig, width='stretch')
+    return fig
+
 
-def render_hours_by_operator(df):
+def render_hours_by_incident(df, selection=None):
+    fig = cached_figure("hours", "hours_by_incident", selection, lambda: build_hours_by_incident(df, selection))
+    plotly_chart(fig, width='stretch')
 
-    df_operators = df[
-        (df["OperatorID"].notna()) &
-        (df["IncidentID"].isna())
-        ]
+def build_hours_by_operator(df, selection=None):
 
     operator_hours = (
-        df_operators
-        .groupby("Operator", as_index=False)["Hours"]
-        .sum()
-        .sort_values("Hours", ascending=True)
+        oee_grouped(df, ["Operator"], selection)
+        .rename(columns={"total_hours": "Hours"})
+        [["Operator", "Hours"]]
     )
+    operator_hours = operator_hours[
+        operator_hours["Hours"] > 0
+    ].sort_values("Hours", ascending=True)
 
     fig = px.bar(
         operator_hours,
@@ -85,10 +83,15 @@ def render_hours_by_operator(df):
         title="Productive Hours by Operator"
     )
 
-    st.plotly_chart(fig, width='stretch')
+    return fig
+
 
-def render_availa(df):
-    monthly_df = calculate_availa_over_time(df)
+def render_hours_by_operator(df, selection=None):
+    fig = cached_figure("hours", "hours_by_operator", selection, lambda: build_hours_by_operator(df, selection))
+    plotly_chart(fig, width='stretch')
+
+def build_availa(df, selection=None):
+    monthly_df = downsample(calculate_availa_over_time(df, selection), "MonthSort", "Availability")
 
     fig = px.line(
         monthly_df,
@@ -108,10 +111,15 @@ def render_availa(df):
     fig.update_traces(text=monthly_df["Availability"].map(lambda x: f"{x:.1%}"),
                       textposition="top center", texttemplate="%{text}")
 
-    st.plotly_chart(fig, width="stretch")
+    return fig
+
 
-def render_dash(df):
-    metrics = calculate_oee(df)
+def render_availa(df, selection=None):
+    fig = cached_figure("hours", "availa", selection, lambda: build_availa(df, selection))
+    plotly_chart(fig, width="stretch")
+
+def render_dash(df, selection=None):
+    metrics = oee_totals(df, selection)
 
     col1, col2, col3, col4 = st.columns(4)
 
@@ -121,49 +129,25 @@ def render_dash(df):
     col5, col6, col7 = st.columns(3)
 
     with col5:
-        render_hours_by_operator(df)
+        render_hours_by_operator(df, selection)
     with col6:
-        render_availa(df)
+        render_availa(df, selection)
     with col7:
-        render_hours_by_incident(df)
+        render_hours_by_incident(df, selection)
 # ===============================
 # MAIN APP
 # ===============================
 st.title("Hours Analysis", anchor=False)
 
-df = load_data()
-fProduction = build_model(df)
-# Month Filter
-months = (
-    fProduction[["MonthLabel", "MonthSort"]]
-    .drop_duplicates()
-    .sort_values("MonthSort")
-)
-month_labels = months["MonthLabel"].tolist()
-
-options = ["Select All"] + month_labels
-
-col1, col2, col3, col4 = st.columns(4)
+# Month / machine / operator / date filters
+selection = render_filters("hours_page")
 
-with col1:
-    selected = st.multiselect(
-        "Select Month(s)",
-        options=options,
-        key="hours_page"
-    )
-if "Select All" in selected and len(selected) > 1:
-    selected = [m for m in selected if m != "Select All"]
-    selected_months = selected
-elif "Select All" in selected or not selected:
-    selected_months = month_labels
+if kpi_backend() in ("sql", "history"):
+    df_filtered = None
 else:
-    selected_months = selected
-
-df_filtered = fProduction[
-    fProduction["MonthLabel"].isin(selected_months)
-]
+    df_filtered = load_filtered_cube(selection)
 
-render_dash(df_filtered)
+render_dash(df_filtered, selection)
 
 st.divider()
 col1, col2 = st.columns([0.9,0.1])
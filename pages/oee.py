@@ -1,8 +1,17 @@
 import streamlit as st
-import pandas as pd
 import plotly.express as px
-from utils.data_loader import load_data, build_model, calculate_oee
+from utils.data_loader import (
+    kpi_backend,
+    load_filtered_cube,
+    oee_grouped,
+    oee_prorated,
+    oee_totals,
+)
 from utils.auth import require_role
+from utils.charts import downsample
+from utils.figure_cache import cached_figure
+from utils.filters import render_filters
+from utils.perf import plotly_chart
 require_role(["admin", "manager", "analyst"])
 
 st.set_page_config(page_title="📈 Dashboard OEE",layout="wide")
@@ -21,46 +30,41 @@ KPI_INFO = {
     "Qty Rejected": "Total rejected units"
 }
 
-def calculate_oee_over_time(df):
+def calculate_oee_over_time(df, selection=None):
 
-    monthly = []
+    monthly_df = oee_grouped(df, ["month"], selection)
+    monthly_df = monthly_df.rename(columns={"oee": "OEE"})
+    monthly_df = monthly_df[["MonthLabel", "MonthSort", "OEE"]]
+    monthly_df = monthly_df.sort_values("MonthSort")
 
-    grouped = df.groupby(["MonthLabel", "MonthSort"])
+    return monthly_df
 
-    for (label, sort), group in grouped:
-        metrics = calculate_oee(group)
 
-        monthly.append({
-            "MonthLabel": label,
-            "MonthSort": sort,
-            "OEE": metrics["oee"]
-        })
+def calculate_oee_by_machine(df, selection=None):
 
-    monthly_df = pd.DataFrame(monthly)
-    monthly_df = monthly_df.sort_values("MonthSort")
+    machine_df = oee_grouped(df, ["machine"], selection)
+    machine_df = machine_df.rename(columns={"oee": "OEE"})
+    machine_df = machine_df[["MachineID", "Machine", "OEE"]]
+    machine_df = machine_df.sort_values("OEE", ascending=True)
 
-    return monthly_df
+    return machine_df
 
 
-def calculate_oee_by_machine(df):
+def calculate_oee_by_shift(selection=None):
 
-    machine_list = []
+    shift_df = oee_prorated(["shift"], selection)
+    shift_df = shift_df.rename(columns={"oee": "OEE"})
 
-    grouped = df.groupby(["MachineID", "Machine"])
+    return shift_df[["Shift", "OEE", "total_hours"]]
 
-    for (machine_id, machine_name), group in grouped:
-        metrics = calculate_oee(group)
 
-        machine_list.append({
-            "MachineID": machine_id,
-            "Machine": machine_name,
-            "OEE": metrics["oee"]
-        })
+def calculate_oee_by_hour(selection=None):
 
-    machine_df = pd.DataFrame(machine_list)
-    machine_df = machine_df.sort_values("OEE", ascending=True)
+    hour_df = oee_prorated(["hour"], selection)
+    hour_df = hour_df.rename(columns={"oee": "OEE"})
+    hour_df = hour_df[["Hour", "OEE"]].sort_values("Hour")
 
-    return machine_df
+    return hour_df
 
 
 
@@ -92,9 +96,9 @@ def render_kpi(label, value, threshold=None, is_percentage=True):
         )
 
 
-def render_oee_over_time(df):
+def build_oee_over_time(df, selection=None):
 
-    monthly_df = calculate_oee_over_time(df)
+    monthly_df = downsample(calculate_oee_over_time(df, selection), "MonthSort", "OEE")
 
     fig = px.line(
         monthly_df,
@@ -114,12 +118,17 @@ def render_oee_over_time(df):
     fig.update_traces(text=monthly_df["OEE"].map(lambda x: f"{x:.1%}"),
                       textposition="top center", texttemplate="%{text}")
 
-    st.plotly_chart(fig, width="stretch")
+    return fig
+
 
+def render_oee_over_time(df, selection=None):
+    fig = cached_figure("oee", "oee_over_time", selection, lambda: build_oee_over_time(df, selection))
+    plotly_chart(fig, width="stretch")
 
-def render_oee_by_machine(df):
 
-    machine_df = calculate_oee_by_machine(df)
+def build_oee_by_machine(df, selection=None):
+
+    machine_df = calculate_oee_by_machine(df, selection)
     machine_df["DisplayName"] = (
             machine_df["Machine"] + " (" + machine_df["MachineID"].astype(str) + ")"
     )
@@ -159,14 +168,94 @@ def render_oee_by_machine(df):
         textposition="outside"
     )
 
-    st.plotly_chart(fig,
-                    width="stretch")
+    return fig
+
+
+def render_oee_by_machine(df, selection=None):
+    fig = cached_figure("oee", "oee_by_machine", selection, lambda: build_oee_by_machine(df, selection))
+    plotly_chart(fig, width="stretch")
+
+def build_oee_by_shift(selection=None):
+
+    shift_df = calculate_oee_by_shift(selection)
+
+    fig = px.bar(
+        shift_df,
+        x="Shift",
+        y="OEE",
+        color="OEE",
+        color_continuous_scale=["red", "yellow", "green"],
+        range_color=[0, 1]
+    )
+
+    fig.update_layout(
+        yaxis_tickformat=".0%",
+        xaxis_title="Shift",
+        yaxis_title="OEE",
+        title="OEE by Shift"
+    )
+    fig.update_coloraxes(colorbar_tickformat=".0%")
+
+    fig.update_traces(
+        text=shift_df["OEE"].map(lambda x: f"{x:.1%}"),
+        textposition="outside",
+        customdata=shift_df[["total_hours"]],
+        hovertemplate="%{x}<br>OEE %{y:.1%}<br>Productive hours %{customdata[0]:,.0f}"
+    )
+
+    fig.add_hline(
+        y=OEE_TARGET,
+        line_dash="dash",
+        line_color="green",
+        annotation_text="Target 85%"
+    )
+
+    return fig
+
+
+def render_oee_by_shift(selection=None):
+    fig = cached_figure("oee", "oee_by_shift", selection, lambda: build_oee_by_shift(selection))
+    plotly_chart(fig, width="stretch")
+
+
+def build_oee_by_hour(selection=None):
+
+    hour_df = calculate_oee_by_hour(selection)
+
+    fig = px.line(
+        hour_df,
+        x="Hour",
+        y="OEE",
+        markers=True
+    )
+
+    fig.update_layout(
+        yaxis_tickformat=".0%",
+        xaxis_title="Hour of Day",
+        yaxis_title="OEE",
+        title="OEE by Hour of Day",
+        xaxis=dict(tickmode="linear", dtick=2, range=[-0.5, 23.5])
+    )
+
+    fig.add_hline(
+        y=OEE_TARGET,
+        line_dash="dash",
+        line_color="green",
+        annotation_text="Target 85%"
+    )
+
+    return fig
 
 
-def render_dashboard(df):
+def render_oee_by_hour(selection=None):
+    fig = cached_figure("oee", "oee_by_hour", selection, lambda: build_oee_by_hour(selection))
+    plotly_chart(fig, width="stretch")
+
+
+def render_dashboard(df, selection=None):
 
     st.header("KPIs", anchor=False)
-    metrics = calculate_oee(df)
+    metrics = oee_totals(df, selection)
 
     col1, col2, col3, col4 = st.columns(4)
 
@@ -187,48 +276,31 @@ def render_dashboard(df):
 
     col8, col9 = st.columns(2)
     with col8:
-        render_oee_over_time(df)
+        render_oee_over_time(df, selection)
     with col9:
-        render_oee_by_machine(df)
+        render_oee_by_machine(df, selection)
+
+    # Entries spanning several shifts or hours count towards each of them
+    col10, col11 = st.columns(2)
+    with col10:
+        render_oee_by_shift(selection)
+    with col11:
+        render_oee_by_hour(selection)
 
 # ===============================
 # MAIN APP
 # ===============================
 st.title("Production Analytical Dashboard", anchor=False)
 OEE_TARGET = 0.85
-tables = load_data()
-fProduction = build_model(tables)
-
-# Month Filter
-months = (
-    fProduction[["MonthLabel", "MonthSort"]]
-    .drop_duplicates()
-    .sort_values("MonthSort")
-)
-month_labels = months["MonthLabel"].tolist()
 
-options = ["Select All"] + month_labels
+# Month / machine / operator / date filters
+selection = render_filters("oee_page")
 
-col1, col2, col3, col4 = st.columns(4)
-
-with col1:
-    selected = st.multiselect(
-        "Select Month(s)",
-        options=options,
-        key="oee_page"
-    )
-if "Select All" in selected and len(selected) > 1:
-    selected = [m for m in selected if m != "Select All"]
-    selected_months = selected
-elif "Select All" in selected or not selected:
-    selected_months = month_labels
+if kpi_backend() in ("sql", "history"):
+    df_filtered = None
 else:
-    selected_months = selected
-
-df_filtered = fProduction[
-    fProduction["MonthLabel"].isin(selected_months)
-]
-render_dashboard(df_filtered)
+    df_filtered = load_filtered_cube(selection)
+render_dashboard(df_filtered, selection)
 st.divider()
 col1, col2 = st.columns([0.9,0.1])
 with col2:
@@ -1,42 +1,35 @@
 import streamlit as st
-from utils.data_loader import load_data, build_model, calculate_oee
+from utils.data_loader import (
+    kpi_backend,
+    load_filtered_cube,
+    oee_grouped,
+)
 import plotly.express as px
-import pandas as pd
 from utils.auth import require_role
+from utils.charts import downsample, line_chart, series_controls
+from utils.figure_cache import cached_figure
+from utils.filters import render_filters
+from utils.perf import plotly_chart
 require_role(["admin", "manager"])
 
 st.set_page_config(page_title="📊 Productivity",layout="wide")
 
-def calculate_productivity_over_time(df):
-
-    monthly = []
-
-    grouped = df.groupby(["MonthLabel", "MonthSort"])
-
-    for (label, sort), group in grouped:
-        metrics = calculate_oee(group)
-
-        monthly.append({
-            "MonthLabel": label,
-            "MonthSort": sort,
-            "Productivity": metrics["productivity"]
-        })
+def calculate_productivity_over_time(df, selection=None):
 
-    monthly_df = pd.DataFrame(monthly)
+    monthly_df = oee_grouped(df, ["month"], selection)
+    monthly_df = monthly_df.rename(columns={"productivity": "Productivity"})
+    monthly_df = monthly_df[["MonthLabel", "MonthSort", "Productivity"]]
     monthly_df = monthly_df.sort_values("MonthSort")
 
     return monthly_df
 
 
-def render_qty_by_machine(df):
-
-    df_machine = df[
-        (df["MachineID"].notna())]
+def build_qty_by_machine(df, selection=None):
 
     machine_qty = (
-        df_machine
-        .groupby("Machine", as_index=False)["QtyProduced"]
-        .sum()
+        oee_grouped(df, ["Machine"], selection)
+        .rename(columns={"qty_produced": "QtyProduced"})
+        [["Machine", "QtyProduced"]]
         .sort_values("QtyProduced", ascending=True)
     )
 
@@ -55,17 +48,19 @@ def render_qty_by_machine(df):
         title="Qty Produced by Machine"
     )
 
-    st.plotly_chart(fig, width='stretch')
+    return fig
+
 
-def render_qty_by_operator(df):
+def render_qty_by_machine(df, selection=None):
+    fig = cached_figure("productivity", "qty_by_machine", selection, lambda: build_qty_by_machine(df, selection))
+    plotly_chart(fig, width='stretch')
 
-    df_operators = df[
-        (df["OperatorID"].notna())]
+def build_qty_by_operator(df, selection=None):
 
     operator_qty = (
-        df_operators
-        .groupby("Operator", as_index=False)["QtyProduced"]
-        .sum()
+        oee_grouped(df, ["Operator"], selection)
+        .rename(columns={"qty_produced": "QtyProduced"})
+        [["Operator", "QtyProduced"]]
         .sort_values("QtyProduced", ascending=True)
     )
 
@@ -85,10 +80,15 @@ def render_qty_by_operator(df):
         title="Qty Produced by Operator"
     )
 
-    st.plotly_chart(fig, width='stretch')
+    return fig
+
+
+def render_qty_by_operator(df, selection=None):
+    fig = cached_figure("productivity", "qty_by_operator", selection, lambda: build_qty_by_operator(df, selection))
+    plotly_chart(fig, width='stretch')
 
-def render_productivity(df):
-    monthly_df = calculate_productivity_over_time(df)
+def build_productivity(df, selection=None):
+    monthly_df = downsample(calculate_productivity_over_time(df, selection), "MonthSort", "Productivity")
 
     fig = px.line(
         monthly_df,
@@ -111,70 +111,56 @@ def render_productivity(df):
     fig.update_traces(text=monthly_df["Productivity"].map(lambda x: f"{x:.1%}"),
                       textposition="top center",texttemplate="%{text}")
 
-    st.plotly_chart(fig, width="stretch")
+    return fig
 
 
-def render_prod(df):
+def render_productivity(df, selection=None):
+    fig = cached_figure("productivity", "productivity", selection, lambda: build_productivity(df, selection))
+    plotly_chart(fig, width="stretch")
+
+def render_prod(df, selection=None):
     # Daily chart
-    daily = df.groupby(df["Date"].dt.date).agg({
-        "Hours": "sum",
-        "QtyProduced": "sum"
-    }).reset_index()
+    daily = (
+        oee_grouped(df, ["day"], selection)
+        .rename(columns={"Day": "Date", "qty_produced": "QtyProduced"})
+        [["Date", "QtyProduced"]]
+    )
 
     st.subheader("QtyProduced by day", anchor=False)
-    fig = px.line(daily, x="Date", y="QtyProduced", markers=True)
-    st.plotly_chart(fig, width="stretch")
+    x_range, full_resolution = series_controls(daily, "Date", "prod_daily")
+    fig = cached_figure(
+        "productivity", "prod", selection,
+        lambda: line_chart(daily, "Date", "QtyProduced", x_range, full_resolution, markers=True),
+        extra=(x_range, full_resolution)
+    )
+    plotly_chart(fig, name="QtyProduced by day", width="stretch")
 
-def render_dash_prod(df):
+def render_dash_prod(df, selection=None):
 
     col1, col2, col3 = st.columns(3)
 
     with col1:
-        render_qty_by_operator(df)
+        render_qty_by_operator(df, selection)
     with col2:
-        render_productivity(df)
+        render_productivity(df, selection)
     with col3:
-        render_qty_by_machine(df)
+        render_qty_by_machine(df, selection)
 
-    render_prod(df)
+    render_prod(df, selection)
 # ===============================
 # MAIN APP
 # ===============================
 st.title("Productivity Analysis", anchor=False)
 
-df = load_data()
-fProduction = build_model(df)
-# Month Filter
-months = (
-    fProduction[["MonthLabel", "MonthSort"]]
-    .drop_duplicates()
-    .sort_values("MonthSort")
-)
-month_labels = months["MonthLabel"].tolist()
-
-options = ["Select All"] + month_labels
-
-col1, col2, col3, col4 = st.columns(4)
+# Month / machine / operator / date filters
+selection = render_filters("prod_page")
 
-with col1:
-    selected = st.multiselect(
-        "Select Month(s)",
-        options=options,
-        key="prod_page"
-    )
-if "Select All" in selected and len(selected) > 1:
-    selected = [m for m in selected if m != "Select All"]
-    selected_months = selected
-elif "Select All" in selected or not selected:
-    selected_months = month_labels
+if kpi_backend() in ("sql", "history"):
+    df_filtered = None
 else:
-    selected_months = selected
-
-df_filtered = fProduction[
-    fProduction["MonthLabel"].isin(selected_months)
-]
+    df_filtered = load_filtered_cube(selection)
 
-render_dash_prod(df_filtered)
+render_dash_prod(df_filtered, selection)
 
 st.divider()
 col1, col2 = st.columns([0.9,0.1])
@@ -0,0 +1,23 @@
+import pytest
+
+from benchmarks.synthetic import generate_tables, write_database
+from utils import data_loader as dl
+from utils import history
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    # Synthetic production tables in a fresh SQLite file
+    url = f"sqlite:///{tmp_path}/oee.db"
+    write_database(generate_tables(500, seed=0), url)
+    monkeypatch.setenv("DATABASE_URL", url)
+    dl.get_engine.clear()
+    yield url
+    dl.get_engine().dispose()
+    dl.get_engine.clear()
+
+
+@pytest.fixture
+def history_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(history, "HISTORY_DIR", tmp_path / "history")
+    return history.HISTORY_DIR
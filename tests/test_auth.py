@@ -0,0 +1,43 @@
+import pytest
+
+from utils import auth
+
+
+@pytest.fixture
+def session_secret(monkeypatch):
+    def use(value):
+        monkeypatch.setenv("SESSION_SECRET", value)
+        auth._session_secret.clear()
+    yield use
+    auth._session_secret.clear()
+
+
+@pytest.mark.parametrize("value", ["change-me", "CHANGE-ME", "too-short-secret"])
+def test_placeholder_and_short_secrets_are_refused(session_secret, value):
+    session_secret(value)
+    with pytest.raises(auth.SessionSecretError):
+        auth.issue_token("admin1", "admin")
+
+
+def test_bad_secret_is_not_an_invalid_token(session_secret):
+    session_secret("k" * 40)
+    token = auth.issue_token("admin1", "admin")
+
+    session_secret("change-me")
+    with pytest.raises(auth.SessionSecretError):
+        auth.verify_token(token)
+
+
+@pytest.mark.parametrize("token", ["", "no-dot", "a.b.c", "abc.!!!", 42])
+def test_malformed_tokens_are_invalid(session_secret, token):
+    session_secret("k" * 40)
+    assert auth.verify_token(token) is None
+
+
+def test_token_round_trip(session_secret):
+    session_secret("k" * 40)
+    token = auth.issue_token("admin1", "admin")
+
+    assert auth.verify_token(token)["sub"] == "admin1"
+    auth.revoke_token(token)
+    assert auth.verify_token(token) is None
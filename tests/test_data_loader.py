@@ -0,0 +1,47 @@
+import pandas as pd
+
+from utils import data_loader as dl
+from utils import perf
+
+
+def _table_memory(name):
+    report = perf.table_memory_report().set_index("table")
+    return report.loc[name, "rows"]
+
+
+def test_filtered_reads_keep_table_memory(database):
+    engine = dl.get_engine()
+    whole = dl.read_table(engine, "fProductionEntries")
+    assert _table_memory("fProductionEntries") == len(whole)
+
+    latest = whole["StartTime"].max()
+    delta = dl.read_table(
+        engine,
+        "fProductionEntries",
+        where=lambda table: table.c.StartTime == latest.strftime("%d-%m-%Y %H:%M:%S")
+    )
+    assert len(delta) < len(whole)
+    assert _table_memory("fProductionEntries") == len(whole)
+
+
+def test_nullable_ids_stay_exact():
+    ids = pd.Series([2**24 + 1, None, 2**31 + 3], dtype="float64")
+    df = dl.optimize_dtypes(pd.DataFrame({"PO_ID": ids, "QtyRejected": [1.0, None, 2.0]}))
+
+    assert df["PO_ID"].tolist()[0] == 2**24 + 1
+    assert df["PO_ID"].tolist()[2] == 2**31 + 3
+    assert df["QtyRejected"].dtype == "float32"
+
+
+def test_unchanged_database_is_not_reloaded_without_snapshots(database, monkeypatch):
+    monkeypatch.setenv("SNAPSHOT_ENABLED", "0")
+    dl._model_store.clear()
+    dl.load_data.clear()
+
+    dl.load_model()
+    store = dl._model_store()
+    version = store["version"]
+
+    dl._reload_in_background(store)
+    assert store["version"] == version
+    dl._model_store.clear()
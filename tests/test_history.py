@@ -0,0 +1,113 @@
+import threading
+
+import pandas as pd
+from sqlalchemy import text
+
+from utils import data_loader as dl
+from utils import history
+
+
+def _history_rows():
+    return sum(
+        len(history.read_partition(files))
+        for files in history.partitions().values()
+    )
+
+
+def _latest_start(engine):
+    with engine.connect() as conn:
+        values = conn.execute(text('SELECT "StartTime" FROM "fProductionEntries"')).scalars()
+        return max(pd.to_datetime(list(values), format="%d-%m-%Y %H:%M:%S"))
+
+
+def test_sync_without_new_rows_keeps_watermark(database, history_dir):
+    dl.sync_history(full=True)
+    watermark = history.read_meta()["watermark"]
+    rows = _history_rows()
+
+    assert watermark == _latest_start(dl.get_engine())
+
+    # Nothing new twice in a row: the second sync starts from the first's meta
+    dl.sync_history()
+    dl.sync_history()
+
+    assert history.read_meta()["watermark"] == watermark
+    assert _history_rows() == rows
+
+
+def test_empty_database_history(database, history_dir):
+    with dl.get_engine().begin() as conn:
+        conn.execute(text('DELETE FROM "fProductionEntries"'))
+
+    dl.sync_history(full=True)
+    dl.sync_history()
+
+    assert history.read_meta()["watermark"] is None
+    assert history.partitions() == {}
+
+
+def test_sync_picks_up_late_and_tied_entries(database, history_dir):
+    dl.sync_history(full=True)
+    rows = _history_rows()
+    watermark = history.read_meta()["watermark"]
+    stamp = watermark.strftime("%d-%m-%Y %H:%M:%S")
+
+    with dl.get_engine().begin() as conn:
+        # A second entry with the same values and StartTime as the latest
+        # one, and one started before it but inserted only now
+        latest = conn.execute(
+            text('SELECT * FROM "fProductionEntries" WHERE "StartTime" = :stamp'),
+            {"stamp": stamp}
+        ).mappings().first()
+        conn.execute(
+            text(
+                'INSERT INTO "fProductionEntries" ({}) VALUES ({})'.format(
+                    ", ".join(f'"{column}"' for column in latest),
+                    ", ".join(f":{column}" for column in latest)
+                )
+            ),
+            [
+                dict(latest),
+                {
+                    **latest,
+                    "StartTime": (watermark - pd.Timedelta(hours=2)).strftime("%d-%m-%Y %H:%M:%S"),
+                },
+            ]
+        )
+
+    dl.sync_history()
+    assert _history_rows() == rows + 2
+
+    # Already in the history, not appended twice
+    dl.sync_history()
+    assert _history_rows() == rows + 2
+
+
+def test_concurrent_syncs_append_once(database, history_dir):
+    dl.sync_history(full=True)
+    rows = _history_rows()
+    watermark = history.read_meta()["watermark"]
+
+    with dl.get_engine().begin() as conn:
+        latest = conn.execute(text('SELECT * FROM "fProductionEntries" LIMIT 1')).mappings().first()
+        conn.execute(
+            text(
+                'INSERT INTO "fProductionEntries" ({}) VALUES ({})'.format(
+                    ", ".join(f'"{column}"' for column in latest),
+                    ", ".join(f":{column}" for column in latest)
+                )
+            ),
+            {
+                **latest,
+                "StartTime": (watermark + pd.Timedelta(hours=1)).strftime("%d-%m-%Y %H:%M:%S"),
+            }
+        )
+
+    # The background thread and a refresh on the script thread at once
+    threads = [threading.Thread(target=dl.sync_history) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert _history_rows() == rows + 1
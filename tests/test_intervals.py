@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils import intervals
+
+
+def _split(spans, kind):
+    start = pd.to_datetime([start for start, _ in spans])
+    end = pd.to_datetime([end for _, end in spans])
+    pieces = intervals.split(start, end, kind)
+    return pd.DataFrame({
+        "row": pieces["row"],
+        "bucket_start": pd.to_datetime(pieces["bucket_start"]),
+        "share": pieces["share"],
+    })
+
+
+SPANS = [
+    ("2024-03-01 10:15", "2024-03-01 11:45"),  # across an hour
+    ("2024-03-01 05:30", "2024-03-01 06:30"),  # across the Morning shift start
+    ("2024-03-01 23:30", "2024-03-02 00:30"),  # across midnight
+    ("2024-02-28 20:00", "2024-03-02 08:00"),  # several days, month end
+    ("2024-03-01 10:00", "2024-03-01 10:00"),  # empty
+]
+
+
+@pytest.mark.parametrize("kind", ["hour", "shift", "day"])
+def test_shares_sum_to_one(kind):
+    pieces = _split(SPANS, kind)
+
+    totals = pieces.groupby("row")["share"].sum()
+    assert totals.index.tolist() == list(range(len(SPANS)))
+    np.testing.assert_allclose(totals, 1)
+
+
+def test_pieces_follow_bucket_edges():
+    hours = _split([SPANS[0]], "hour")
+    assert hours["bucket_start"].dt.hour.tolist() == [10, 11]
+    np.testing.assert_allclose(hours["share"], [0.5, 0.5])
+
+    shifts = intervals.split(
+        pd.to_datetime([SPANS[1][0]]), pd.to_datetime([SPANS[1][1]]), "shift"
+    )
+    names = [name for name, _ in intervals.shift_calendar()]
+    # Night of the day before, then Morning
+    assert [names[shift] for shift in shifts["shift"]] == ["Night", "Morning"]
+    np.testing.assert_allclose(shifts["share"], [0.5, 0.5])
+
+    days = _split([SPANS[2]], "day")
+    assert days["bucket_start"].dt.day.tolist() == [1, 2]
+    np.testing.assert_allclose(days["share"], [0.5, 0.5])
+
+
+def test_missing_and_reversed_ends_stay_whole():
+    start = pd.to_datetime(["2024-03-01 10:30", "2024-03-01 10:30"])
+    end = pd.to_datetime([None, "2024-03-01 09:00"])
+    pieces = intervals.split(start, end, "hour")
+
+    assert pieces["row"].tolist() == [0, 1]
+    np.testing.assert_allclose(pieces["share"], [1, 1])
@@ -0,0 +1,57 @@
+import heapq
+import itertools
+import smtplib
+import threading
+
+from utils import mailer
+
+
+class FlakyServer:
+    # Accepts the main mail, then fails the confirmation: the connection
+    # drops, and after the reconnect the server answers with a transient
+    # error once
+    delivered = []
+    errors = [
+        smtplib.SMTPServerDisconnected("gone"),
+        smtplib.SMTPDataError(451, "try again later"),
+    ]
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def starttls(self):
+        pass
+
+    def login(self, username, password):
+        pass
+
+    def sendmail(self, sender, recipient, body):
+        if body == "confirmation" and self.errors:
+            raise self.errors.pop(0)
+        self.delivered.append(body)
+
+    def quit(self):
+        pass
+
+
+def test_retries_resume_after_accepted_messages(monkeypatch):
+    monkeypatch.setattr(smtplib, "SMTP", FlakyServer)
+    settings = {
+        "host": "localhost", "port": 25, "starttls": False, "username": None,
+        "password": None, "timeout": 1, "idle_seconds": 1,
+    }
+    store = {"jobs": {}, "lock": threading.Lock()}
+    job = {
+        "id": "job", "status": "queued", "attempts": 0, "error": None,
+        "messages": [("a@x", "b@x", "main"), ("a@x", "b@x", "confirmation")],
+        "sent": 0, "settings": settings, "check_address": None,
+    }
+    connections, retries, counter = {}, [], itertools.count()
+
+    mailer._process(store, connections, retries, counter, job)
+    assert job["status"] == "retrying"
+    assert FlakyServer.delivered == ["main"]
+
+    mailer._process(store, connections, retries, counter, heapq.heappop(retries)[2])
+    assert job["status"] == "sent"
+    assert FlakyServer.delivered == ["main", "confirmation"]
@@ -0,0 +1,70 @@
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic import generate_tables
+from utils import data_loader as dl
+from utils import duckdb_engine
+
+
+@pytest.fixture
+def tables():
+    return generate_tables(2_000, seed=1)
+
+
+def _reference_oee(tables, key):
+    # KPIs per key straight from the raw tables, merges and all
+    entries = tables["fProductionEntries"].merge(
+        tables["fProductionOrders"][["PO_ID", "ProductID"]], on="PO_ID", how="left"
+    ).merge(tables["dProduct"][["ProductID", "ItemsPerHour"]], on="ProductID", how="left")
+    start = pd.to_datetime(entries["StartTime"], format="%d-%m-%Y %H:%M:%S")
+    end = pd.to_datetime(entries["EndTime"], format="%d-%m-%Y %H:%M:%S")
+    entries["Hours"] = (end - start).dt.total_seconds() / 3600
+    entries["MonthSort"] = start.dt.year * 100 + start.dt.month
+
+    rows = []
+    for value, group in entries.groupby(key):
+        productive = group[group["IncidentID"].isna()]
+        outage = group[group["IncidentID"].notna()]
+        planned = (productive["ItemsPerHour"] * productive["Hours"]).sum()
+        produced = group["QtyProduced"].sum()
+        rejected = group["QtyRejected"].sum()
+        availability = productive["Hours"].sum() / group["Hours"].sum()
+        productivity = produced / planned if planned else 0
+        quality = produced / (produced + rejected) if produced + rejected else 0
+        rows.append({
+            key: value,
+            "availability": availability,
+            "productivity": productivity,
+            "quality": quality,
+            "oee": availability * productivity * quality,
+        })
+    return pd.DataFrame(rows).set_index(key)
+
+
+@pytest.mark.parametrize("dim, key", [("machine", "MachineID"), ("month", "MonthSort")])
+def test_grouped_oee_matches_reference(tables, dim, key):
+    grouped = dl.calculate_oee_grouped(dl.build_model(tables), [dim]).set_index(key)
+    expected = _reference_oee(tables, key)
+
+    assert sorted(grouped.index) == sorted(expected.index)
+    pd.testing.assert_frame_equal(
+        grouped.loc[expected.index, expected.columns],
+        expected,
+        check_names=False,
+        check_index_type=False,
+        rtol=1e-5
+    )
+
+
+def test_duckdb_matches_pandas(tables, monkeypatch):
+    model = dl.build_model(tables)
+    cube = dl.build_cube(model)
+
+    monkeypatch.setenv("DATAFRAME_ENGINE", "duckdb")
+    monkeypatch.setattr(duckdb_engine, "MIN_ROWS", 0)
+    pd.testing.assert_frame_equal(dl.build_model(tables), model)
+
+    def ordered(df):
+        return df.sort_values(dl.CUBE_KEYS).reset_index(drop=True)
+
+    pd.testing.assert_frame_equal(ordered(dl.build_cube(model)), ordered(cube), rtol=1e-9)
@@ -1,8 +1,17 @@
 import streamlit as st
+import base64
+import hashlib
+import hmac
 import json
+import secrets
 import bcrypt
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
 from pathlib import Path
 import os
+from streamlit_js_eval import streamlit_js_eval
+from utils.perf import cache_resource
 
 base_path = os.path.dirname(__file__)
 users_path = os.path.join(base_path, '..', 'data', 'users.json')
@@ -10,41 +19,318 @@ users_path = os.path.join(base_path, '..', 'data', 'users.json')
 USERS_FILE = Path(users_path)
 
 
+class LoginRejected(Exception):
+    # Login refused before the password could be checked
+    pass
+
+
+class SessionSecretError(Exception):
+    # SESSION_SECRET is set to something that cannot sign tokens safely
+    pass
+
+
+# Parsed users file, shared by every session and re-read only when the
+# file changes on disk
+@cache_resource
+def _user_store():
+    return {"stamp": None, "users": {}, "lock": threading.Lock()}
+
+
 def load_users():
-    if USERS_FILE.exists():
-        with open(USERS_FILE, "r") as f:
-            return json.load(f)
-    return {}
+    store = _user_store()
+    try:
+        stat = USERS_FILE.stat()
+        stamp = (stat.st_mtime_ns, stat.st_size)
+    except FileNotFoundError:
+        return {}
+
+    with store["lock"]:
+        if store["stamp"] != stamp:
+            with open(USERS_FILE, "r") as f:
+                store["users"] = json.load(f)
+            store["stamp"] = stamp
+        return store["users"]
+
+
+# ===============================
+# PASSWORD CHECK
+# ===============================
+
+# bcrypt runs on a few worker threads so a burst of logins cannot take
+# every core, and a script run waits at most AUTH_TIMEOUT_SECONDS for it
+@cache_resource
+def _hash_pool():
+    workers = int(os.getenv("AUTH_WORKERS", min(4, os.cpu_count() or 1)))
+    return ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
 
 
 def verify_password(password, hashed):
     return bcrypt.checkpw(password.encode(), hashed.encode())
 
 
+def _verify_in_pool(password, hashed):
+    future = _hash_pool().submit(verify_password, password, hashed)
+    try:
+        return future.result(timeout=float(os.getenv("AUTH_TIMEOUT_SECONDS", "10")))
+    except TimeoutError:
+        future.cancel()
+        raise LoginRejected("Login is busy, please try again in a moment.")
+
+
+# ===============================
+# FAILED-ATTEMPT THROTTLING
+# ===============================
+
+# Failures per username, known or not. After AUTH_MAX_FAILURES the user is
+# locked out for AUTH_LOCKOUT_SECONDS, doubled on each further failure.
+MAX_LOCKOUT_SECONDS = 15 * 60
+MAX_TRACKED_USERS = 10_000
+
+
+@cache_resource
+def _attempt_store():
+    return {"failures": {}, "lock": threading.Lock()}
+
+
+def _lockout_remaining(username):
+    store = _attempt_store()
+    with store["lock"]:
+        entry = store["failures"].get(username)
+        if entry is None:
+            return 0
+        return max(0, entry["locked_until"] - time.monotonic())
+
+
+def _record_failure(username):
+    max_failures = int(os.getenv("AUTH_MAX_FAILURES", "5"))
+    lockout = float(os.getenv("AUTH_LOCKOUT_SECONDS", "60"))
+    now = time.monotonic()
+
+    store = _attempt_store()
+    with store["lock"]:
+        failures = store["failures"]
+        if len(failures) >= MAX_TRACKED_USERS:
+            # Drop entries that are no longer locked out
+            for name in [n for n, e in failures.items() if e["locked_until"] <= now]:
+                del failures[name]
+
+        entry = failures.setdefault(username, {"count": 0, "locked_until": 0})
+        entry["count"] += 1
+        excess = entry["count"] - max_failures
+        if excess >= 0:
+            entry["locked_until"] = now + min(lockout * 2 ** excess, MAX_LOCKOUT_SECONDS)
+
+
+def _clear_failures(username):
+    store = _attempt_store()
+    with store["lock"]:
+        store["failures"].pop(username, None)
+
+
+# ===============================
+# SESSION TOKENS
+# ===============================
+
+# Signed, expiring tokens kept in a browser cookie, so a refresh or a new
+# tab restores the session with an HMAC check instead of a new login.
+# Revoked tokens are remembered by this process only, until they expire:
+# with a fixed SESSION_SECRET a token revoked at logout is accepted again
+# after a restart, or by another replica, until its expiry.
+SESSION_COOKIE = "oee_session"
+
+# Anyone can sign tokens with these
+PLACEHOLDER_SECRETS = {"change-me", "changeme", "secret", "session-secret", "your-secret"}
+MIN_SECRET_LENGTH = 32
+
+
+@cache_resource
+def _session_secret():
+    # Without SESSION_SECRET tokens do not survive a restart
+    secret = os.getenv("SESSION_SECRET")
+    if not secret:
+        return secrets.token_bytes(32)
+    if secret.lower() in PLACEHOLDER_SECRETS or len(secret) < MIN_SECRET_LENGTH:
+        raise SessionSecretError(
+            f"SESSION_SECRET must be a random value of at least {MIN_SECRET_LENGTH} "
+            "characters, e.g. python -c \"import secrets; print(secrets.token_urlsafe(32))\""
+        )
+    return secret.encode()
+
+
+def check_session_secret():
+    # Raises SessionSecretError at startup rather than on the first token
+    _session_secret()
+
+
+@cache_resource
+def _revoked_store():
+    return {"revoked": {}, "lock": threading.Lock()}
+
+
+def _session_ttl():
+    return int(float(os.getenv("SESSION_TTL_HOURS", "12")) * 3600)
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _signature(body):
+    return hmac.new(_session_secret(), body.encode(), hashlib.sha256).digest()
+
+
+def issue_token(username, role):
+    payload = {
+        "sub": username,
+        "role": role,
+        "exp": int(time.time()) + _session_ttl(),
+        "jti": secrets.token_urlsafe(12),
+    }
+    body = _b64encode(json.dumps(payload, separators=(",", ":")).encode())
+    return f"{body}.{_b64encode(_signature(body))}"
+
+
+def verify_token(token):
+    # Payload of a valid, unexpired and unrevoked token, otherwise None.
+    # Only malformed tokens count as invalid, a bad secret still raises.
+    try:
+        body, signature = token.split(".")
+        signature = _b64decode(signature)
+    except (AttributeError, ValueError):
+        return None
+
+    if not hmac.compare_digest(signature, _signature(body)):
+        return None
+
+    try:
+        payload = json.loads(_b64decode(body))
+        expired = payload["exp"] <= time.time()
+        jti = payload["jti"]
+    except (ValueError, KeyError, TypeError):
+        return None
+    if expired:
+        return None
+
+    store = _revoked_store()
+    with store["lock"]:
+        if jti in store["revoked"]:
+            return None
+    return payload
+
+
+def revoke_token(token):
+    payload = verify_token(token)
+    if payload is None:
+        return
+
+    store = _revoked_store()
+    now = time.time()
+    with store["lock"]:
+        revoked = store["revoked"]
+        for jti in [jti for jti, exp in revoked.items() if exp <= now]:
+            del revoked[jti]
+        revoked[payload["jti"]] = payload["exp"]
+
+
+def _start_session(username, role, token):
+    st.session_state.authenticated = True
+    st.session_state.username = username
+    st.session_state.role = role
+    st.session_state.session_token = token
+
+
+def restore_session():
+    # Session from the cookie sent with the page request. The role comes
+    # from the users file, so role changes apply on the next refresh.
+    token = st.context.cookies.get(SESSION_COOKIE)
+    payload = verify_token(token) if token else None
+    if payload is None:
+        return False
+
+    user = load_users().get(payload["sub"])
+    if user is None:
+        return False
+
+    _start_session(payload["sub"], user["role"], token)
+    return True
+
+
+def check_session():
+    # Cheap check on every run: restore from the cookie when the session is
+    # new, log out when the token was revoked or has expired
+    if not st.session_state.get("authenticated"):
+        return restore_session()
+
+    token = st.session_state.get("session_token")
+    if token and verify_token(token) is None:
+        logout()
+        return False
+    return True
+
+
+def sync_session_cookie():
+    # Cookies can only be written from the browser; done on the run after
+    # login / logout. Secure: browsers only send it over HTTPS (and to
+    # localhost).
+    action = st.session_state.pop("session_cookie_action", None)
+    if action == "set":
+        value = st.session_state.session_token
+        max_age = _session_ttl()
+    elif action == "clear":
+        value = ""
+        max_age = 0
+    else:
+        return
+
+    streamlit_js_eval(
+        js_expressions=(
+            f"parent.document.cookie = '{SESSION_COOKIE}={value}; path=/; "
+            f"max-age={max_age}; Secure; SameSite=Strict'"
+        ),
+        key=f"session_cookie_{action}"
+    )
+
+
 def login(username, password):
+    remaining = _lockout_remaining(username)
+    if remaining:
+        raise LoginRejected(
+            f"Too many failed attempts, try again in {int(remaining) + 1} seconds."
+        )
+
     users = load_users()
     user = users.get(username)
 
-    if user and verify_password(password, user["password"]):
-        st.session_state.authenticated = True
-        st.session_state.username = username
-        st.session_state.role = user["role"]
+    if user and _verify_in_pool(password, user["password"]):
+        _clear_failures(username)
+        _start_session(username, user["role"], issue_token(username, user["role"]))
+        st.session_state.session_cookie_action = "set"
         return True
 
+    _record_failure(username)
     return False
 
 
 def logout():
-    for key in ["authenticated", "username", "role"]:
+    token = st.session_state.get("session_token")
+    if token:
+        revoke_token(token)
+        st.session_state.session_cookie_action = "clear"
+
+    for key in ["authenticated", "username", "role", "session_token"]:
         if key in st.session_state:
             del st.session_state[key]
 
 
 def require_role(allowed_roles):
-    if "authenticated" not in st.session_state:
+    if not check_session():
         st.error("Please login first.")
         st.stop()
 
     if st.session_state.role not in allowed_roles:
         st.error("Access denied.")
-        st.stop()
\ No newline at end of file
+        st.stop()
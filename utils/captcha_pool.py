@@ -0,0 +1,66 @@
+import os
+import random
+import threading
+import time
+from collections import deque
+
+from captcha.image import ImageCaptcha
+
+from utils.perf import cache_resource
+
+# Pre-rendered CAPTCHAs shared by every session. A background thread keeps
+# the pool topped up, so serving one is a pop instead of rendering a PNG in
+# the script thread. Entries leave the pool when served and expire
+# CAPTCHA_TTL_SECONDS after that.
+WIDTH = 400
+HEIGHT = 100
+LENGTH = 6
+
+
+def _pool_size():
+    return int(os.getenv("CAPTCHA_POOL_SIZE", "20"))
+
+
+def _ttl():
+    return float(os.getenv("CAPTCHA_TTL_SECONDS", "600"))
+
+
+def _render(generator, options):
+    text = "".join(random.choices(options, k=LENGTH))
+    return text, generator.generate(text).getvalue()
+
+
+def _refill(store, options):
+    # Fonts are loaded once per generator, keep it for the thread's lifetime
+    generator = ImageCaptcha(width=WIDTH, height=HEIGHT)
+    while True:
+        store["wake"].wait(timeout=5)
+        store["wake"].clear()
+        while len(store["entries"]) < _pool_size():
+            store["entries"].append(_render(generator, options))
+
+
+@cache_resource
+def _captcha_store(options):
+    store = {"entries": deque(), "wake": threading.Event()}
+    threading.Thread(
+        target=_refill, args=(store, options), name="captcha-pool", daemon=True
+    ).start()
+    store["wake"].set()
+    return store
+
+
+def take_captcha(options):
+    # (answer, PNG bytes, expiry timestamp); rendered on the spot only when
+    # the pool ran dry
+    store = _captcha_store(options)
+    try:
+        text, image = store["entries"].popleft()
+    except IndexError:
+        text, image = _render(ImageCaptcha(width=WIDTH, height=HEIGHT), options)
+    store["wake"].set()
+    return text, image, time.time() + _ttl()
+
+
+def captcha_expired(captcha):
+    return captcha[2] <= time.time()
@@ -0,0 +1,124 @@
+import os
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import streamlit as st
+
+# Keeps line charts light whatever the history length: series longer than
+# CHART_MAX_POINTS are downsampled (LTTB by default, min-max per bucket with
+# CHART_DOWNSAMPLE=minmax) over the visible x range, and drawn with WebGL
+# (scattergl) above CHART_WEBGL_THRESHOLD points.
+
+
+def max_points():
+    return int(os.getenv("CHART_MAX_POINTS", "2000"))
+
+
+def webgl_threshold():
+    return int(os.getenv("CHART_WEBGL_THRESHOLD", "1000"))
+
+
+def _numeric(values):
+    values = pd.Series(values)
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values.astype("int64").to_numpy(dtype=float)
+    return values.to_numpy(dtype=float)
+
+
+def lttb(x, y, threshold):
+    # Largest-Triangle-Three-Buckets: positions of the points to keep, first
+    # and last always included
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    x = _numeric(x)
+    y = _numeric(y)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+
+    selected = np.empty(threshold, dtype=int)
+    selected[0] = 0
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            next_x = x[edges[i + 1]:edges[i + 2]].mean()
+            next_y = y[edges[i + 1]:edges[i + 2]].mean()
+        else:
+            next_x, next_y = x[-1], y[-1]
+
+        area = np.abs(
+            (x[a] - next_x) * (y[start:end] - y[a]) -
+            (x[a] - x[start:end]) * (next_y - y[a])
+        )
+        a = start + int(np.nanargmax(area)) if np.isfinite(area).any() else start
+        selected[i + 1] = a
+
+    selected[-1] = n - 1
+    return selected
+
+
+def minmax(y, threshold):
+    # Lowest and highest point of each bucket, keeps every spike
+    n = len(y)
+    if threshold >= n or threshold < 4:
+        return np.arange(n)
+
+    y = _numeric(y)
+    edges = np.linspace(0, n, (threshold - 2) // 2 + 1).astype(int)
+    keep = [0, n - 1]
+    for start, end in zip(edges[:-1], edges[1:]):
+        if end > start:
+            keep += [start + int(np.nanargmin(y[start:end])), start + int(np.nanargmax(y[start:end]))]
+    return np.unique(keep)
+
+
+def downsample(df, x, y, x_range=None, threshold=None):
+    # Rows of df (sorted by x) to draw, at most threshold of them within
+    # x_range. Zooming into a short range gets back to full resolution.
+    threshold = threshold or max_points()
+    df = df.sort_values(x)
+    if x_range is not None:
+        df = df[(df[x] >= x_range[0]) & (df[x] <= x_range[1])]
+
+    if len(df) <= threshold:
+        return df
+
+    if os.getenv("CHART_DOWNSAMPLE", "lttb") == "minmax":
+        positions = minmax(df[y], threshold)
+    else:
+        positions = lttb(df[x], df[y], threshold)
+    return df.iloc[positions]
+
+
+def series_controls(df, x, key):
+    # Viewport slider and full-resolution toggle, only for series too long
+    # to draw point by point. Returns (x_range, full_resolution).
+    if len(df) <= max_points():
+        return None, False
+
+    low, high = df[x].min(), df[x].max()
+    if pd.api.types.is_datetime64_any_dtype(df[x]):
+        low, high = low.to_pydatetime(), high.to_pydatetime()
+
+    col1, col2 = st.columns([4, 1])
+    x_range = col1.slider("Range", low, high, (low, high), key=f"{key}_range")
+    full_resolution = col2.toggle(
+        "Full resolution",
+        key=f"{key}_full",
+        help=f"Draw every point instead of at most {max_points()}"
+    )
+    return x_range, full_resolution
+
+
+def line_chart(df, x, y, x_range=None, full_resolution=False, **kwargs):
+    # px.line over the downsampled series, WebGL when still large
+    if full_resolution:
+        if x_range is not None:
+            df = df[(df[x] >= x_range[0]) & (df[x] <= x_range[1])]
+    else:
+        df = downsample(df, x, y, x_range)
+
+    render_mode = "webgl" if len(df) > webgl_threshold() else "auto"
+    return px.line(df, x=x, y=y, render_mode=render_mode, **kwargs)
@@ -1,63 +1,347 @@
 import os
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import pandas as pd
-import streamlit as st
-from sqlalchemy import create_engine, inspect
+from sqlalchemy import Integer, Numeric, and_, case, create_engine, func, inspect, make_url, select, text
+from sqlalchemy.exc import SQLAlchemyError
 from dotenv import load_dotenv
+from utils.schema import (
+    REQUIRED_COLUMNS,
+    SCHEMA,
+    SchemaError,
+    timestamp_columns,
+    typed_select,
+    validate_tables,
+)
+from utils.sql import (
+    TIMESTAMP_FORMAT,
+    day_of,
+    hours_between,
+    month_sort,
+    months_predicate,
+    reflect_table,
+    timestamp_column,
+    timestamp_value,
+)
+from utils import duckdb_engine, history, intervals
+from utils.perf import cache_data, cache_resource, record_table_memory, span, timed
+from utils.snapshot import (
+    clear_snapshot,
+    read_snapshot,
+    snapshot_enabled,
+    write_snapshot,
+)
 
 load_dotenv()
 
-@st.cache_resource
+@cache_resource
 def get_engine():
-    return create_engine(os.environ["DATABASE_URL"])
+    url = os.environ["DATABASE_URL"]
+    if make_url(url).get_backend_name() == "sqlite":
+        return create_engine(url)
 
-@st.cache_data
+    # Serverless Postgres suspends idle computes and drops their connections:
+    # pre-ping replaces dead ones on checkout, recycle retires them before
+    # the server does
+    return create_engine(
+        url,
+        pool_size=int(os.getenv("DB_POOL_SIZE", "5")),
+        max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "5")),
+        pool_recycle=int(os.getenv("DB_POOL_RECYCLE", "300")),
+        pool_pre_ping=os.getenv("DB_POOL_PRE_PING", "1") == "1",
+    )
+
+
+def chunk_rows():
+    # Rows fetched at a time from a fact table
+    return int(os.getenv("DB_CHUNK_ROWS", "50000"))
+
+
+def _iter_chunks(engine, name, query, parse_dates, sizes=None):
+    # Fact tables come through a server-side cursor chunk_rows() at a time,
+    # each chunk compacted before the next one is fetched, so the raw result
+    # set is never held in full. sizes, if given, adds up the rows and raw
+    # bytes of the chunks as they arrive.
+    contract = SCHEMA.get(name, {}).get("columns", {})
+    numeric = [
+        column for column, (kind, _) in contract.items()
+        if kind in ("integer", "float")
+    ]
+
+    with engine.connect() as conn:
+        if engine.dialect.supports_server_side_cursors:
+            conn = conn.execution_options(
+                stream_results=True,
+                max_row_buffer=chunk_rows()
+            )
+        for chunk in pd.read_sql(
+            query, conn, parse_dates=parse_dates, chunksize=chunk_rows()
+        ):
+            # A chunk where a column is all NULL gets it as object
+            for column in numeric:
+                if column in chunk and chunk[column].dtype == object:
+                    chunk[column] = pd.to_numeric(chunk[column])
+            if sizes is not None:
+                sizes["rows"] += len(chunk)
+                sizes["raw_bytes"] += int(chunk.memory_usage(deep=True).sum())
+            yield optimize_dtypes(chunk, copy=False)
+
+
+def _read_chunks(engine, name, query, parse_dates, whole=True):
+    # whole: the read covers the entire table, so its size goes to the
+    # Performance panel; filtered reads (deltas, month slices) don't
+    sizes = {"rows": 0, "raw_bytes": 0}
+    chunks = list(_iter_chunks(engine, name, query, parse_dates, sizes))
+    if len(chunks) == 1:
+        df = chunks[0]
+    else:
+        # Integer widths may differ between chunks, settle them once more
+        df = optimize_dtypes(concat_models(chunks), copy=False)
+    if whole:
+        record_table_memory(
+            name, sizes["rows"], sizes["raw_bytes"], int(df.memory_usage(deep=True).sum())
+        )
+    return df
+
+
+def _table_query(engine, name, where=None, order_by=None):
+    # Typed select following utils.schema and its timestamp columns; where
+    # and order_by build a filter / sort key from the reflected table
+    table, query = typed_select(engine, name)
+    if where is not None:
+        query = query.where(where(table))
+    if order_by is not None:
+        query = query.order_by(order_by(table))
+
+    parse_dates = [
+        column for column in timestamp_columns(name)
+        if column in table.c
+    ]
+    return query, parse_dates
+
+
+def read_table(engine, name, where=None):
+    # The span covers the reflection round trips as well as the read
+    with span(f"read_table[{name}]"):
+        query, parse_dates = _table_query(engine, name, where)
+        if name.startswith("f"):
+            return _read_chunks(engine, name, query, parse_dates, whole=where is None)
+        return pd.read_sql(query, engine, parse_dates=parse_dates)
+
+
+def iter_table(engine, name, where=None, order_by=None):
+    # Compacted chunks of a fact table, for callers that never need it whole
+    query, parse_dates = _table_query(engine, name, where, order_by)
+    yield from _iter_chunks(engine, name, query, parse_dates)
+
+
+def _check_schema(tables, required):
+    # Violations are reported once per load; errors stop here instead of
+    # failing somewhere inside a page
+    issues = validate_tables(tables, required)
+    _model_store()["schema_issues"] = issues
+    if any(issue["severity"] == "error" for issue in issues):
+        raise SchemaError(issues)
+
+
+# Dimension tables are read concurrently, LOAD_WORKERS at a time, next to
+# the fact tables. Fact tables are streamed one after the other: each is
+# compacted chunk by chunk, and reading two at once would hold both raw
+# chunk sets in memory together. Every read holds one connection of the
+# engine's pool while it runs.
+@cache_resource
+def _load_pool():
+    workers = int(os.getenv("LOAD_WORKERS", "6"))
+    return ThreadPoolExecutor(max_workers=workers, thread_name_prefix="load")
+
+
+def _read_in_turn(engine, names):
+    return {name: read_table(engine, name) for name in names}
+
+
+def read_tables(engine, names):
+    # {name: frame} in the order of names; each read is timed as its own
+    # read_table[name] span
+    facts = [name for name in names if name.startswith("f")]
+    futures = {
+        name: _load_pool().submit(read_table, engine, name)
+        for name in names if name not in facts
+    }
+    fact_tables = _load_pool().submit(_read_in_turn, engine, facts)
+
+    tables = {name: future.result() for name, future in futures.items()}
+    tables.update(fact_tables.result())
+    return {name: tables[name] for name in names}
+
+
+@cache_data
+@timed()
 def load_data():
     engine = get_engine()
     inspector = inspect(engine)
     table_names = inspector.get_table_names()
 
-    tables = {}
-    for table in table_names:
-        if table.startswith(("d", "f")):
-            tables[table] = pd.read_sql_table(table, engine)
+    tables = read_tables(engine, [
+        table for table in table_names
+        if table.startswith(("d", "f"))
+    ])
+
+    _check_schema(tables, REQUIRED_COLUMNS)
+    return tables
+
+
+@cache_data
+@timed()
+def load_dimensions():
+    # Everything build_model needs besides the entries themselves
+    engine = get_engine()
+    inspector = inspect(engine)
+    table_names = inspector.get_table_names()
+
+    tables = read_tables(engine, [
+        table for table in table_names
+        if table.startswith(("d", "f")) and table != "fProductionEntries"
+    ])
 
+    required = dict(REQUIRED_COLUMNS)
+    del required["fProductionEntries"]
+    _check_schema(tables, required)
     return tables
 
 # ===============================
 # DATA MODEL
 # ===============================
 
-def build_model(tables):
+def dataframe_engine():
+    # "pandas", or "duckdb" for the model build and grouped sums of frames
+    # with at least duckdb_engine.MIN_ROWS rows. Both give the same frames.
+    return os.getenv("DATAFRAME_ENGINE", "pandas")
 
-    fProduction = tables["fProductionEntries"]
-    fProductionOrder = tables["fProductionOrders"]
-    dProduct = tables["dProduct"]
 
-    # Merge ProductID
-    fProduction = fProduction.merge(
-        fProductionOrder[["PO_ID", "ProductID"]],
-        on="PO_ID",
-        how="left"
+def _on_duckdb(df):
+    return dataframe_engine() == "duckdb" and len(df) >= duckdb_engine.MIN_ROWS
+
+
+def _lookup(dim, key, column, values):
+    # dim[column] for every key in values, found through an index on the
+    # dimension key rather than a merge that copies the whole fact table
+    dim = dim.drop_duplicates(key)
+    positions = pd.Index(dim[key]).get_indexer(values)
+    return _take(dim, column, positions)
+
+
+def _take(dim, column, positions):
+    # dim[column] at positions, -1 for no match. Unique labels come back as
+    # a categorical over the dimension rows.
+    attribute = dim[column]
+
+    if (
+        not pd.api.types.is_numeric_dtype(attribute) and
+        attribute.notna().all() and
+        attribute.is_unique
+    ):
+        return pd.Categorical.from_codes(positions, categories=attribute.to_numpy())
+
+    return pd.api.extensions.take(
+        attribute.to_numpy(),
+        positions,
+        allow_fill=True
     )
 
-    # Merge ItemsPerHour
-    fProduction = fProduction.merge(
-        dProduct[["ProductID", "ItemsPerHour"]],
-        on="ProductID",
-        how="left"
+
+def _month_names(month_sort):
+    # MonthName and MonthLabel categoricals for MonthSort values, worked out
+    # once per month instead of once per row
+    months, codes = np.unique(month_sort, return_inverse=True)
+    first_days = pd.to_datetime(pd.DataFrame({
+        "year": months // 100,
+        "month": months % 100,
+        "day": 1,
+    }))
+    names = first_days.dt.month_name(locale="en_US.utf8")
+    labels = names + " " + (months // 100).astype(str)
+
+    columns = {}
+    for column, values in (("MonthName", names), ("MonthLabel", labels)):
+        categories, month_codes = np.unique(values.to_numpy(dtype=object), return_inverse=True)
+        columns[column] = pd.Categorical.from_codes(month_codes[codes], categories=categories)
+    return columns
+
+
+def _build_model_duckdb(tables):
+    # Same model as build_model, with the joins and date columns computed
+    # by DuckDB
+    fProduction = tables["fProductionEntries"].copy(deep=False)
+    for column in ["StartTime", "EndTime"]:
+        if not pd.api.types.is_datetime64_any_dtype(fProduction[column]):
+            fProduction[column] = pd.to_datetime(
+                fProduction[column],
+                format=TIMESTAMP_FORMAT
+            )
+
+    orders = tables["fProductionOrders"].drop_duplicates("PO_ID")
+    products = tables["dProduct"].drop_duplicates("ProductID")
+    machines = tables["dMachine"].drop_duplicates("MachineID")
+    incidents = tables["dIncident"].drop_duplicates("IncidentID")
+    operators = tables["dOperator"].drop_duplicates("OperatorID")
+
+    columns = duckdb_engine.model_columns(
+        fProduction,
+        orders[["PO_ID", "ProductID"]],
+        products[["ProductID"]],
+        machines[["MachineID"]],
+        incidents[["IncidentID"]],
+        operators[["OperatorID"]],
     )
+    months = _month_names(columns["MonthSort"])
+
+    fProduction["ProductID"] = _take(orders, "ProductID", columns["order_pos"])
+    fProduction["ItemsPerHour"] = _take(products, "ItemsPerHour", columns["product_pos"])
+    fProduction["Hours"] = columns["Hours"]
+    fProduction["Date"] = fProduction["StartTime"]
+    fProduction["Day"] = columns["Day"]
+    fProduction["Year"] = columns["Year"]
+    fProduction["MonthNumber"] = columns["MonthNumber"]
+    fProduction["MonthName"] = months["MonthName"]
+    fProduction["MonthLabel"] = months["MonthLabel"]
+    fProduction["MonthSort"] = columns["MonthSort"]
+    fProduction["Machine"] = _take(machines, "Machine", columns["machine_pos"])
+    fProduction["Incident"] = _take(incidents, "Incident", columns["incident_pos"])
+    fProduction["Operator"] = _take(operators, "Operator", columns["operator_pos"])
+    return optimize_dtypes(fProduction, copy=False)
+
+
+@timed()
+def build_model(tables):
+    if _on_duckdb(tables["fProductionEntries"]):
+        return _build_model_duckdb(tables)
+
+    # Shallow copy: new columns are added without touching the loaded table
+    fProduction = tables["fProductionEntries"].copy(deep=False)
+    fProductionOrder = tables["fProductionOrders"]
+    dProduct = tables["dProduct"]
 
-    # Datetime conversion
-    fProduction["StartTime"] = pd.to_datetime(
-        fProduction["StartTime"],
-        format="%d-%m-%Y %H:%M:%S"
+    # Lookup ProductID
+    fProduction["ProductID"] = _lookup(
+        fProductionOrder, "PO_ID", "ProductID", fProduction["PO_ID"]
     )
 
-    fProduction["EndTime"] = pd.to_datetime(
-        fProduction["EndTime"],
-        format="%d-%m-%Y %H:%M:%S"
+    # Lookup ItemsPerHour
+    fProduction["ItemsPerHour"] = _lookup(
+        dProduct, "ProductID", "ItemsPerHour", fProduction["ProductID"]
     )
 
+    # Datetime conversion, only for text that did not come through read_table
+    for column in ["StartTime", "EndTime"]:
+        if not pd.api.types.is_datetime64_any_dtype(fProduction[column]):
+            fProduction[column] = pd.to_datetime(
+                fProduction[column],
+                format=TIMESTAMP_FORMAT
+            )
+
     # Hours calculation
     fProduction["Hours"] = (
         fProduction["EndTime"] - fProduction["StartTime"]
@@ -65,6 +349,7 @@ def build_model(tables):
 
     # Date columns
     fProduction["Date"] = fProduction["StartTime"]
+    fProduction["Day"] = fProduction["Date"].dt.normalize()
     fProduction["Year"] = fProduction["Date"].dt.year
     fProduction["MonthNumber"] = fProduction["Date"].dt.month
     fProduction["MonthName"] = fProduction["Date"].dt.month_name(locale="en_US.utf8")
@@ -79,67 +364,1490 @@ def build_model(tables):
     dMachine = tables["dMachine"]
     dIncident = tables["dIncident"]
     dOperator = tables["dOperator"]
-    # Merge Machine Name
-    fProduction = fProduction.merge(
-        dMachine[["MachineID", "Machine"]],
-        on="MachineID",
-        how="left"
+    # Lookup Machine Name
+    fProduction["Machine"] = _lookup(
+        dMachine, "MachineID", "Machine", fProduction["MachineID"]
+    )
+
+    fProduction["Incident"] = _lookup(
+        dIncident, "IncidentID", "Incident", fProduction["IncidentID"]
+    )
+
+    fProduction["Operator"] = _lookup(
+        dOperator, "OperatorID", "Operator", fProduction["OperatorID"]
+    )
+    return optimize_dtypes(fProduction, copy=False)
+
+
+# ===============================
+# COMPACT DTYPES
+# ===============================
+
+# Labels repeated on every row
+CATEGORY_COLUMNS = [
+    "MachineID",
+    "ProductID",
+    "Machine",
+    "Operator",
+    "Incident",
+    "MonthName",
+    "MonthLabel",
+]
+
+# Downcast to the smallest integer type. With NULLs they become floats:
+# float64 for the IDs, which float32 would round past 2**24 so lookups and
+# joins on them miss, float32 for the others
+INTEGER_COLUMNS = [
+    "PO_ID",
+    "OperatorID",
+    "IncidentID",
+    "QtyRejected",
+    "Year",
+    "MonthNumber",
+    "MonthSort",
+]
+
+ID_COLUMNS = [
+    "PO_ID",
+    "OperatorID",
+    "IncidentID",
+]
+
+# float32 keeps ~7 significant digits, plenty for hours and quantities.
+# Sums are still done in float64 (see _oee_measures).
+FLOAT_COLUMNS = [
+    "QtyProduced",
+    "ItemsPerHour",
+    "Hours",
+]
+
+
+def optimize_dtypes(df, copy=True):
+    if copy:
+        df = df.copy()
+
+    for column in CATEGORY_COLUMNS:
+        if column in df and not isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].astype("category")
+
+    # Month labels in calendar order
+    if "MonthLabel" in df and "MonthSort" in df:
+        months = df[["MonthLabel", "MonthSort"]].drop_duplicates("MonthLabel")
+        df["MonthLabel"] = df["MonthLabel"].cat.reorder_categories(
+            months.sort_values("MonthSort")["MonthLabel"].dropna().tolist(),
+            ordered=True
+        )
+
+    for column in INTEGER_COLUMNS:
+        if column not in df:
+            continue
+        if pd.api.types.is_integer_dtype(df[column]):
+            df[column] = pd.to_numeric(df[column], downcast="integer")
+        elif pd.api.types.is_float_dtype(df[column]):
+            df[column] = df[column].astype("float64" if column in ID_COLUMNS else "float32")
+
+    for column in FLOAT_COLUMNS:
+        if column in df and pd.api.types.is_float_dtype(df[column]):
+            df[column] = df[column].astype("float32")
+        elif column in df and pd.api.types.is_integer_dtype(df[column]):
+            df[column] = pd.to_numeric(df[column], downcast="integer")
+
+    return df
+
+
+def concat_models(models):
+    # pd.concat turns categoricals with different categories into object,
+    # union them first
+    models = [model for model in models if not model.empty]
+    for column in CATEGORY_COLUMNS:
+        if all(
+            column in model and isinstance(model[column].dtype, pd.CategoricalDtype)
+            for model in models
+        ):
+            categories = pd.api.types.union_categoricals(
+                [model[column] for model in models],
+                ignore_order=True
+            ).categories
+            ordered = models[0][column].cat.ordered
+            models = [
+                model.assign(**{column: model[column].cat.set_categories(categories, ordered=ordered)})
+                for model in models
+            ]
+
+    return pd.concat(models, ignore_index=True)
+
+# ===============================
+# SHARED MODEL
+# ===============================
+
+# Fact tables that can be refreshed incrementally and their watermark column.
+# New orders are expected to have a higher PO_ID than everything loaded.
+# Entries are often inserted when they end, after later-starting ones, so
+# the last INCREMENTAL_OVERLAP_HOURS before the StartTime watermark are read
+# again and only rows not loaded yet are kept. Entries inserted later than
+# that, and updates or deletes, need a Full Reload.
+INCREMENTAL_KEYS = {
+    "fProductionOrders": "PO_ID",
+    "fProductionEntries": "StartTime",
+}
+
+
+def incremental_overlap():
+    return pd.Timedelta(hours=float(os.getenv("INCREMENTAL_OVERLAP_HOURS", "48")))
+
+
+def _comparable(values):
+    # Same representation whatever a frame's compaction chose
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values.astype(object)
+    if pd.api.types.is_numeric_dtype(values):
+        return values.astype("float64")
+    return values
+
+
+def _unseen_rows(rows, seen):
+    # Rows not in seen yet, compared on every column of rows and counting
+    # repeats: two identical entries in the database stay two
+    columns = list(rows.columns)
+
+    def numbered(df):
+        df = pd.DataFrame({column: _comparable(df[column]) for column in columns})
+        df["occurrence"] = df.groupby(columns, dropna=False).cumcount()
+        return df
+
+    matched = numbered(rows).merge(
+        numbered(seen),
+        on=columns + ["occurrence"],
+        how="left",
+        indicator=True
     )
+    return rows[(matched["_merge"] == "left_only").to_numpy()]
+
+
+# One enriched fact table per data version, shared by every page and session.
+# Pages must treat it as read-only.
+@cache_resource
+def _model_store():
+    return {
+        "version": 0,
+        "model": None,
+        "tables": {},
+        "watermarks": {},
+        "schema_issues": [],
+        "cube": None,
+        "cube_index": None,
+        "fingerprint": None,
+        "view_fingerprint": None,
+        "refreshed_at": None,
+        "lock": threading.Lock(),
+    }
+
+
+def schema_issues():
+    return _model_store()["schema_issues"]
+
+
+def _set_model(store, tables, model, refreshed_at=None):
+    # Raw entries are not kept: once enriched they only live in the model.
+    # refreshed_at is when the data last matched the database.
+    store["tables"] = {
+        name: table for name, table in tables.items()
+        if name != "fProductionEntries"
+    }
+    store["watermarks"] = {
+        "fProductionOrders": tables["fProductionOrders"]["PO_ID"].max(),
+        "fProductionEntries": model["StartTime"].max(),
+    }
+    store["model"] = model
+    store["cube"] = None
+    store["cube_index"] = None
+    store["refreshed_at"] = refreshed_at or time.time()
+
+
+# Freshness check behind the snapshot and the background refresh: it
+# changes with inserts, updates and deletes. PostgreSQL keeps per-table
+# write counters (pg_stat_user_tables, plus the file node a TRUNCATE
+# replaces), so no table is scanned. The SQLite stand-in is scanned for row
+# counts and per-column aggregates instead.
+PG_TABLE_STATS = text("""
+    SELECT s.relname, s.n_tup_ins, s.n_tup_upd, s.n_tup_del, c.relfilenode
+    FROM pg_stat_user_tables s
+    JOIN pg_class c ON c.oid = s.relid
+    WHERE s.schemaname = current_schema()
+""")
+
+
+def data_fingerprint(engine):
+    # {table: values that change when its rows do} for every d*/f* table
+    def tracked(name):
+        return name.startswith(("d", "f"))
+
+    if engine.dialect.name == "postgresql":
+        with engine.connect() as conn:
+            return {
+                row[0]: [int(value) for value in row[1:]]
+                for row in conn.execute(PG_TABLE_STATS)
+                if tracked(row[0])
+            }
+
+    def aggregates(name, column):
+        if isinstance(column.type, (Integer, Numeric)):
+            return [func.sum(column)]
+        if column.name in timestamp_columns(name):
+            timestamp = timestamp_column(column, engine.dialect.name)
+            return [func.sum(func.julianday(timestamp))]
+        return [func.sum(func.length(column)), func.min(column), func.max(column)]
+
+    inspector = inspect(engine)
+    fingerprint = {}
+    with engine.connect() as conn:
+        for name in filter(tracked, inspector.get_table_names()):
+            table = reflect_table(engine, name)
+            columns = [
+                aggregate
+                for column in table.c
+                for aggregate in aggregates(name, column)
+            ]
+            fingerprint[name] = list(conn.execute(
+                select(func.count(), *columns).select_from(table)
+            ).one())
+    return fingerprint
+
+
+def _save_snapshot(store, fingerprint):
+    with store["lock"]:
+        tables = store["tables"]
+        model = store["model"]
+        store["fingerprint"] = fingerprint
+    write_snapshot(tables, model, fingerprint)
+
+
+def _load_tables_and_model():
+    # Returns tables, model, the database fingerprint they match (None when
+    # unknown), whether to snapshot them and when they last matched the
+    # database (None for now). The fingerprint is taken before the read
+    # even without snapshots: the background refresh compares against it.
+    snapshot = read_snapshot() if snapshot_enabled() else None
+    try:
+        fingerprint = data_fingerprint(get_engine())
+    except SQLAlchemyError:
+        # Database unreachable, run offline from the snapshot
+        if snapshot is None:
+            raise
+        return snapshot["tables"], snapshot["model"], None, False, snapshot["written_at"]
 
-    fProduction = fProduction.merge(
-        dIncident[["IncidentID","Incident"]],
-        on="IncidentID",
-        how="left"
+    if snapshot is not None and snapshot["fingerprint"] == fingerprint:
+        return snapshot["tables"], snapshot["model"], fingerprint, False, None
+
+    tables = load_data()
+    return tables, build_model(tables), fingerprint, snapshot_enabled(), None
+
+
+def load_model():
+    store = _model_store()
+    with store["lock"]:
+        if store["model"] is not None:
+            return store["model"]
+        tables, model, fingerprint, save, refreshed_at = _load_tables_and_model()
+        _set_model(store, tables, model, refreshed_at)
+        store["fingerprint"] = fingerprint
+
+    if save:
+        _save_snapshot(store, fingerprint)
+    if refresh_interval() > 0:
+        _refresh_worker()
+    return model
+
+
+def data_version():
+    return _model_store()["version"]
+
+
+def _newer(engine, column, watermark):
+    # where builder for rows past the watermark
+    dialect = engine.dialect.name
+
+    def newer(table):
+        target = table.c[column]
+        if column in ("StartTime", "EndTime"):
+            value = timestamp_value(watermark, target, dialect)
+            target = timestamp_column(target, dialect)
+        else:
+            value = watermark.item() if hasattr(watermark, "item") else watermark
+        return target > value
+
+    return newer
+
+
+def _read_delta(engine, table_name, column, watermark):
+    if pd.isna(watermark):
+        return read_table(engine, table_name)
+    return read_table(engine, table_name, where=_newer(engine, column, watermark))
+
+
+@timed("refresh_incremental")
+def _refresh_incremental(store):
+    with store["lock"]:
+        base_model = store["model"]
+        base_cube = store["cube"]
+        base_index = store["cube_index"]
+        tables = dict(store["tables"])
+        watermarks = dict(store["watermarks"])
+
+    engine = get_engine()
+    fingerprint = data_fingerprint(engine) if snapshot_enabled() else None
+
+    # Dimensions are small, reload them whole
+    tables.update(read_tables(engine, [
+        name for name in tables if name.startswith("d")
+    ]))
+
+    new_orders = _read_delta(
+        engine,
+        "fProductionOrders",
+        INCREMENTAL_KEYS["fProductionOrders"],
+        watermarks["fProductionOrders"]
     )
+    if not new_orders.empty:
+        tables["fProductionOrders"] = pd.concat(
+            [tables["fProductionOrders"], new_orders],
+            ignore_index=True
+        )
 
-    fProduction = fProduction.merge(
-        dOperator[["OperatorID","Operator"]],
-        on="OperatorID",
-        how="left"
+    watermark = watermarks["fProductionEntries"]
+    if pd.notna(watermark):
+        watermark = watermark - incremental_overlap()
+    new_entries = _read_delta(
+        engine,
+        "fProductionEntries",
+        INCREMENTAL_KEYS["fProductionEntries"],
+        watermark
     )
-    return fProduction
+    if pd.notna(watermark) and not new_entries.empty:
+        seen = base_model.loc[base_model["StartTime"] > watermark, new_entries.columns]
+        new_entries = _unseen_rows(new_entries, seen)
+    if new_entries.empty and new_orders.empty:
+        with store["lock"]:
+            if store["model"] is base_model:
+                store["refreshed_at"] = time.time()
+        return
+
+    # Only the delta rows go through the enrichment steps
+    model = base_model
+    delta = None
+    if not new_entries.empty:
+        # Small deltas lose the history's dtypes (an all-NULL IncidentID
+        # arrives as object), make those numeric again before merging
+        for column in new_entries.columns:
+            if (
+                new_entries[column].isna().all() and
+                pd.api.types.is_numeric_dtype(base_model[column])
+            ):
+                new_entries[column] = new_entries[column].astype("float64")
+        delta = build_model({**tables, "fProductionEntries": new_entries})
+        model = concat_models([base_model, delta])
+
+    # Cube and index are rebuilt before the swap, readers never wait on them
+    cube, index = base_cube, base_index
+    if base_cube is not None and delta is not None:
+        cube = build_cube(concat_models([base_cube, build_cube(delta)]))
+        index = build_filter_index(cube)
+    elif base_cube is not None and index is None:
+        index = build_filter_index(cube)
+    _reload_dimensions()
+
+    with store["lock"]:
+        # A full refresh happened meanwhile, its model wins
+        if store["model"] is not base_model:
+            return
+        _set_model(store, tables, model)
+        store["cube"] = cube
+        store["cube_index"] = index
+        store["version"] += 1
+
+    if fingerprint is not None:
+        _save_snapshot(store, fingerprint)
+
+
+def filter_pushdown():
+    # Load only the selected months from the database instead of slicing
+    # the full model
+    return os.getenv("FILTER_PUSHDOWN", "0") == "1"
+
+
+@cache_resource(max_entries=16)
+def load_model_slice(months, version=0):
+    # Model for the given MonthSort values, read with a StartTime range
+    # predicate. version is only part of the cache key.
+    engine = get_engine()
+    tables = load_dimensions()
+    tables["fProductionEntries"] = read_table(
+        engine,
+        "fProductionEntries",
+        where=lambda entries: months_predicate(
+            entries.c.StartTime, months, engine.dialect.name
+        )
+    )
+    return build_model(tables)
+
+
+def load_filtered_model(months=None):
+    # months are MonthSort values, None for every month
+    if months is None:
+        return load_model()
+
+    if filter_pushdown():
+        return load_model_slice(tuple(sorted(months)), data_version())
+
+    model = load_model()
+    return model[model["MonthSort"].isin(months)]
+
+
+def refresh_data(incremental=False):
+    store = _model_store()
+    loaded = store["model"] is not None or kpi_backend() == "history"
+    if refresh_interval() > 0 and loaded:
+        # The background thread reloads, pages keep the current data
+        request_refresh(incremental)
+        return
+
+    if kpi_backend() == "history":
+        _refresh_history(store, full=not incremental)
+        return
+
+    load_dimensions.clear()
+    if kpi_backend() == "sql" and cube_view_enabled():
+        refresh_cube_view(get_engine())
+
+    if incremental and store["model"] is not None:
+        _refresh_incremental(store)
+        return
+
+    load_data.clear()
+    clear_snapshot()
+    with store["lock"]:
+        store["model"] = None
+        store["version"] += 1
+
+# ===============================
+# BACKGROUND REFRESH
+# ===============================
+
+# Stale-while-revalidate: every REFRESH_INTERVAL_SECONDS a background thread
+# checks the database and, when it changed, loads the tables and builds the
+# model, cube and filter index next to the current ones. The new version is
+# swapped in under the store lock in one step; until then every page keeps
+# reading the previous version, so no script run waits on the database.
+def refresh_interval():
+    # 0 turns the background refresh off
+    return float(os.getenv("REFRESH_INTERVAL_SECONDS", "0"))
+
+
+@cache_resource
+def _refresh_worker():
+    worker = {
+        "wake": threading.Event(),
+        "request": None,
+        "running": False,
+        "error": None,
+        "lock": threading.Lock(),
+    }
+    threading.Thread(
+        target=_refresh_loop,
+        args=(worker, _model_store()),
+        name="data-refresh",
+        daemon=True
+    ).start()
+    return worker
+
+
+def request_refresh(incremental=False):
+    # Refresh now instead of at the next interval. A full reload wins over
+    # an incremental one requested meanwhile.
+    worker = _refresh_worker()
+    with worker["lock"]:
+        if worker["request"] != "full":
+            worker["request"] = "incremental" if incremental else "full"
+    worker["wake"].set()
+
+
+@timed("refresh_background")
+def _reload_in_background(store, force=False):
+    engine = get_engine()
+    fingerprint = data_fingerprint(engine)
+    with store["lock"]:
+        base_model = store["model"]
+        unchanged = store["fingerprint"] == fingerprint
+
+    if unchanged and not force:
+        with store["lock"]:
+            if store["model"] is base_model:
+                store["refreshed_at"] = time.time()
+        return
+
+    load_data.clear()
+    tables = load_data()
+    model = build_model(tables)
+    cube = build_cube(model)
+    index = build_filter_index(cube)
+    _reload_dimensions()
+
+    with store["lock"]:
+        _set_model(store, tables, model)
+        store["cube"] = cube
+        store["cube_index"] = index
+        store["version"] += 1
+
+    if snapshot_enabled():
+        _save_snapshot(store, fingerprint)
+    else:
+        with store["lock"]:
+            store["fingerprint"] = fingerprint
+
+
+def _reload_dimensions():
+    # Read again and cached before a swap, so the next page run finds the
+    # filter options loaded instead of reading them itself
+    load_dimensions.clear()
+    load_dimensions()
+
+
+@timed("refresh_cube_view")
+def _refresh_cube_view_in_background(store, force=False):
+    # The SQL backend's oee_cube view follows the database like the model
+    engine = get_engine()
+    fingerprint = data_fingerprint(engine)
+    with store["lock"]:
+        unchanged = store["view_fingerprint"] == fingerprint
+    if unchanged and not force:
+        return
+
+    refresh_cube_view(engine)
+    with store["lock"]:
+        store["view_fingerprint"] = fingerprint
+        store["version"] += 1
+        store["refreshed_at"] = time.time()
+
+
+def _refresh_loop(worker, store):
+    while True:
+        worker["wake"].wait(timeout=refresh_interval() or None)
+        worker["wake"].clear()
+        with worker["lock"]:
+            request = worker["request"]
+            worker["request"] = None
+            worker["running"] = True
+
+        try:
+            if kpi_backend() == "sql" and cube_view_enabled():
+                _refresh_cube_view_in_background(store, force=request is not None)
+            if kpi_backend() == "history":
+                _refresh_history(store, full=request == "full")
+            # Nothing to revalidate until a page loaded the model
+            elif store["model"] is not None:
+                if request == "incremental":
+                    _refresh_incremental(store)
+                else:
+                    _reload_in_background(store, force=request == "full")
+            error = None
+        except Exception as e:
+            # Keep serving the current version, try again next time
+            error = str(e)
+
+        with worker["lock"]:
+            worker["running"] = False
+            worker["error"] = error
+
+
+def data_status():
+    # Age in seconds of the data pages are served (None before the first
+    # load), whether a background refresh is running and its last error
+    store = _model_store()
+    with store["lock"]:
+        refreshed_at = store["refreshed_at"]
+    status = {
+        "age": None if refreshed_at is None else time.time() - refreshed_at,
+        "refreshing": False,
+        "error": None,
+    }
+    if refresh_interval() > 0:
+        worker = _refresh_worker()
+        with worker["lock"]:
+            status["refreshing"] = worker["running"]
+            status["error"] = worker["error"]
+    return status
 
 # ===============================
 # CALCULATIONS
 # ===============================
 
+# Dashboard dimensions and the model columns they group by
+DIMENSIONS = {
+    "month": ["MonthLabel", "MonthSort"],
+    "machine": ["MachineID", "Machine"],
+    "operator": ["OperatorID", "Operator"],
+    "day": ["Day"],
+    "incident": ["IncidentID", "Incident"],
+    # Bucket cubes only, see oee_prorated
+    "hour": ["Hour"],
+    "shift": ["Shift"],
+}
+
+# Additive sums behind every KPI, named as in calculate_oee's result
+MEASURES = [
+    "total_hours",
+    "outage_hours",
+    "qty_planned",
+    "qty_produced",
+    "qty_rejected",
+]
+
+
+def _oee_measures(df):
+
+    # Pre-aggregated frames (the rollup cube) already carry the measures
+    if all(measure in df for measure in MEASURES):
+        return df[MEASURES].astype("float64")
+
+    productive = df["IncidentID"].isna()
+    hours = df["Hours"].astype("float64")
+
+    return pd.DataFrame({
+        "total_hours": hours.where(productive, 0),
+        "outage_hours": hours.where(~productive, 0),
+        "qty_planned": (df["ItemsPerHour"] * hours).where(productive, 0),
+        "qty_produced": df["QtyProduced"].astype("float64"),
+        "qty_rejected": df["QtyRejected"].astype("float64"),
+    }, index=df.index)
+
+
+def _ratio(numerator, denominator):
+    return (numerator / denominator.where(denominator > 0)).fillna(0)
+
+
+def _oee_ratios(sums):
+
+    sums["availability"] = _ratio(
+        sums["total_hours"],
+        sums["total_hours"] + sums["outage_hours"]
+    )
+    sums["productivity"] = _ratio(sums["qty_produced"], sums["qty_planned"])
+    sums["quality"] = _ratio(
+        sums["qty_produced"],
+        sums["qty_produced"] + sums["qty_rejected"]
+    )
+    sums["oee"] = sums["availability"] * sums["productivity"] * sums["quality"]
+
+    return sums
+
+
+def _duckdb_sums(df, keys, dropna):
+    # grouped_sums with the key columns back in their source dtypes
+    measures = MEASURES if all(measure in df for measure in MEASURES) else None
+    sums = duckdb_engine.grouped_sums(df, keys, dropna, measures)
+    for key in keys:
+        sums[key] = sums[key].astype(df[key].dtype)
+    return sums
+
+
+@timed()
 def calculate_oee(df):
 
-    total_hours = df["Hours"].sum()
-    outage_hours = df[df["IncidentID"].notna()]["Hours"].sum()
-    productive_hours = df[df["IncidentID"].isna()]["Hours"].sum()
+    if _on_duckdb(df):
+        sums = _duckdb_sums(df, [], True)
+    else:
+        sums = _oee_measures(df).sum().to_frame().T
+    return _metrics_dict(_oee_ratios(sums).iloc[0])
+
+
+def _metrics_dict(metrics):
+    return {
+        "availability": metrics["availability"],
+        "productivity": metrics["productivity"],
+        "quality": metrics["quality"],
+        "oee": metrics["oee"],
+        "qty_produced": metrics["qty_produced"],
+        "qty_planned": metrics["qty_planned"],
+        "qty_rejected": metrics["qty_rejected"],
+        "total_hours": metrics["total_hours"],
+        "outage_hours": metrics["outage_hours"],
+    }
+
+
+def _dimension_keys(dims):
+    keys = []
+    for dim in dims:
+        keys += [key for key in DIMENSIONS.get(dim, [dim]) if key not in keys]
+    return keys
+
+
+def calculate_oee_grouped(df, dims):
+    # One groupby-sum over the additive measures, then the KPI ratios per
+    # group. dims are DIMENSIONS names or plain model columns.
+    keys = _dimension_keys(dims)
+
+    with span(f"calculate_oee_grouped[{','.join(dims)}]"):
+        if _on_duckdb(df):
+            grouped = _duckdb_sums(df, keys, True)
+        else:
+            grouped = _oee_measures(df).groupby(
+                [df[key] for key in keys],
+                observed=True
+            ).sum().reset_index()
+
+    # Results are small, hand back plain labels rather than categoricals
+    for key in keys:
+        if isinstance(grouped[key].dtype, pd.CategoricalDtype):
+            grouped[key] = grouped[key].astype(grouped[key].cat.categories.dtype)
+
+    return _oee_ratios(grouped)
+
+
+# ===============================
+# ROLLUP CUBE
+# ===============================
+
+# Grain of the cube; month columns ride along for filtering
+CUBE_KEYS = [
+    "Day",
+    "MonthLabel",
+    "MonthSort",
+    "MachineID",
+    "Machine",
+    "OperatorID",
+    "Operator",
+    "IncidentID",
+    "Incident",
+]
+
+# Database-side cube (materialized view on PostgreSQL, table on SQLite)
+CUBE_VIEW = "oee_cube"
+CUBE_VIEW_KEYS = ["MonthSort", "Day", "MachineID", "OperatorID", "IncidentID"]
+
+
+@timed()
+def build_cube(df):
+    # Additive measures at day x machine x operator x incident grain. Works
+    # on the model or on cubes, so deltas can be rolled into an existing one.
+    keys = [key for key in CUBE_KEYS if key in df]
+    if _on_duckdb(df):
+        return _duckdb_sums(df, keys, False)
+
+    return _oee_measures(df).groupby(
+        [df[key] for key in keys],
+        observed=True,
+        dropna=False
+    ).sum().reset_index()
+
+
+def load_cube():
+    return load_indexed_cube()[0]
+
+
+def load_indexed_cube():
+    # The shared cube and its filter index, always from the same build
+    model = load_model()
+    store = _model_store()
+    with store["lock"]:
+        if store["model"] is not model:
+            # Refreshed meanwhile, do not cache a cube of the old model
+            cube = build_cube(model)
+            return cube, build_filter_index(cube)
+        if store["cube"] is None:
+            store["cube"] = build_cube(model)
+        if store["cube_index"] is None:
+            store["cube_index"] = build_filter_index(store["cube"])
+        return store["cube"], store["cube_index"]
+
+
+@cache_resource(max_entries=16)
+def load_cube_slice(months, version=0):
+    return build_cube(load_model_slice(months, version))
+
+
+def load_filtered_cube(selection=None):
+    # Pages read the cube, sliced by a Selection (None for everything)
+    if selection is None:
+        return load_cube()
+
+    if selection.months is not None and filter_pushdown():
+        cube = load_cube_slice(selection.months, data_version())
+        # Already down to the selected months, a mask is enough for the rest
+        return cube[_selection_mask(cube, selection._replace(months=None))]
 
-    availability = (
-        productive_hours / (productive_hours + outage_hours)
-        if (productive_hours + outage_hours) > 0 else 0
+    cube, index = load_indexed_cube()
+    return cube.take(select_rows(index, selection))
+
+
+# ===============================
+# INTERVAL BUCKETS
+# ===============================
+
+# The model and the cube put a whole entry on the day it started. Bucket
+# cubes cut entries at hour, shift or day boundaries (utils.intervals) and
+# prorate their measures by each piece's share of the entry's hours. Day
+# and month columns follow the piece (a shift's day is the day it starts),
+# so Selections filter bucket cubes like the cube.
+BUCKET_KEYS = [
+    "Day",
+    "MonthLabel",
+    "MonthSort",
+    "MachineID",
+    "Machine",
+    "OperatorID",
+    "Operator",
+]
+
+
+def _bucket_kind(dims):
+    kinds = [dim for dim in dims if dim in ("hour", "shift")]
+    if len(kinds) > 1:
+        raise ValueError("Group by hour or by shift, not both")
+    return kinds[0] if kinds else "day"
+
+
+def _with_previous_months(months):
+    # Entries that started the month before can reach into these months
+    if months is None:
+        return None
+    previous = {
+        month - 1 if month % 100 > 1 else month - 89
+        for month in months
+    }
+    return tuple(sorted(set(months) | previous))
+
+
+@timed()
+def build_bucket_cube(df, kind):
+    # Prorated measures at BUCKET_KEYS grain, plus Hour (0-23) or Shift
+    # (ordered as the shift calendar) for those kinds
+    pieces = intervals.split(df["StartTime"], df["EndTime"], kind)
+    row = pieces["row"]
+
+    cube = pd.DataFrame(
+        _oee_measures(df).to_numpy()[row] * pieces["share"][:, None],
+        columns=MEASURES
     )
+    start = pd.DatetimeIndex(pieces["bucket_start"].view("datetime64[ns]"))
+    cube["Day"] = start.normalize()
+    cube["MonthSort"] = start.year * 100 + start.month
+    sorts = cube["MonthSort"].dropna().unique()
+    labels = _month_label(pd.Series(sorts.astype("int64")))
+    cube["MonthLabel"] = cube["MonthSort"].map(dict(zip(sorts, labels)))
+    for key in ["MachineID", "Machine", "OperatorID", "Operator"]:
+        cube[key] = df[key].take(row).reset_index(drop=True)
+
+    if kind == "hour":
+        cube["Hour"] = start.hour
+    elif kind == "shift":
+        cube["Shift"] = pd.Categorical.from_codes(
+            pieces["shift"],
+            categories=[name for name, _ in intervals.shift_calendar()],
+            ordered=True
+        )
+
+    return _sum_bucket_cube(optimize_dtypes(cube, copy=False), kind)
+
+
+def _sum_bucket_cube(cube, kind):
+    # Bucket cubes are additive: pieces or partial cubes roll up alike
+    keys = BUCKET_KEYS + (DIMENSIONS[kind] if kind in ("hour", "shift") else [])
+    return cube.groupby(keys, observed=True, dropna=False)[MEASURES].sum().reset_index()
+
+
+@cache_resource(max_entries=16)
+def load_bucket_cube(kind, months=None, version=0):
+    # months: only entries that started in these months (FILTER_PUSHDOWN)
+    model = load_model() if months is None else load_model_slice(months, version)
+    return build_bucket_cube(model, kind)
+
+
+@cache_resource(max_entries=16)
+def stream_bucket_cube(kind, months=None, version=0):
+    # SQL backend: the bucket cube folded chunk by chunk from the database,
+    # so the model is never loaded. months narrows the read to entries that
+    # started in them. version is only part of the cache key.
+    engine = get_engine()
+    dimensions = load_dimensions()
+    where = None
+    if months is not None:
+        where = lambda entries: months_predicate(
+            entries.c.StartTime, months, engine.dialect.name
+        )
+
+    cube = None
+    for chunk in iter_table(engine, "fProductionEntries", where=where):
+        if chunk.empty and cube is not None:
+            continue
+        part = build_bucket_cube(
+            build_model({**dimensions, "fProductionEntries": chunk}),
+            kind
+        )
+        cube = part if cube is None else _sum_bucket_cube(concat_models([cube, part]), kind)
+    return cube
 
-    df_productive = df[df["IncidentID"].isna()].copy()
-    df_productive["Planned"] = (
-        df_productive["ItemsPerHour"] * df_productive["Hours"]
+
+# ===============================
+# FILTER INDEX
+# ===============================
+
+# Page filters. Fields are sorted tuples of MonthSort / MachineID /
+# OperatorID values, dates an inclusive (first, last) day; None means no
+# filter on that dimension.
+Selection = namedtuple("Selection", ["months", "machines", "operators", "dates"])
+
+# Selection field -> cube column with per-value row positions
+INDEX_KEYS = {
+    "months": "MonthSort",
+    "machines": "MachineID",
+    "operators": "OperatorID",
+    "incidents": "IncidentID",
+}
+
+
+def make_selection(months=None, machines=None, operators=None, dates=None):
+    # Normalized, hashable selection; None when nothing is filtered
+    def values(items, cast):
+        return None if items is None else tuple(sorted(set(cast(item) for item in items)))
+
+    if dates is not None:
+        dates = (pd.Timestamp(dates[0]).normalize(), pd.Timestamp(dates[1]).normalize())
+
+    selection = Selection(
+        values(months, int),
+        values(machines, str),
+        values(operators, int),
+        dates,
     )
+    if all(field is None for field in selection):
+        return None
+    return selection
 
-    qty_planned = df_productive["Planned"].sum()
-    qty_produced = df["QtyProduced"].sum()
-    qty_rejected = df["QtyRejected"].sum()
 
-    productivity = qty_produced / qty_planned if qty_planned > 0 else 0
+def build_filter_index(cube):
+    # Row positions of the cube per value of each filterable key, and the
+    # rows in day order for date ranges. Selections become unions and
+    # intersections of small sorted arrays instead of scans of the cube.
+    positions = {}
+    for field, column in INDEX_KEYS.items():
+        if column in cube:
+            positions[field] = cube.groupby(
+                column, observed=True, dropna=False, sort=False
+            ).indices
 
-    quality = (
-        qty_produced / (qty_produced + qty_rejected)
-        if (qty_produced + qty_rejected) > 0 else 0
+    day_order = np.argsort(cube["Day"].to_numpy(), kind="stable")
+    months = (
+        cube[["MonthLabel", "MonthSort"]]
+        .drop_duplicates()
+        .sort_values("MonthSort")
+        .reset_index(drop=True)
     )
+    months["MonthLabel"] = months["MonthLabel"].astype(str)
+
+    return {
+        "rows": len(cube),
+        "positions": positions,
+        "day_order": day_order,
+        "days": cube["Day"].to_numpy()[day_order],
+        "months": months,
+    }
+
+
+def select_rows(index, selection):
+    # Sorted cube row positions matching every filter of the selection
+    rows = None
+
+    def intersect(rows, found):
+        return found if rows is None else np.intersect1d(rows, found, assume_unique=True)
+
+    for field in ("months", "machines", "operators"):
+        values = getattr(selection, field)
+        if values is None:
+            continue
+        per_value = index["positions"][field]
+        found = [per_value[value] for value in values if value in per_value]
+        found = np.sort(np.concatenate(found)) if found else np.empty(0, dtype=np.intp)
+        rows = intersect(rows, found)
+
+    if selection.dates is not None:
+        first, last = (np.datetime64(day, "ns") for day in selection.dates)
+        start = np.searchsorted(index["days"], first, side="left")
+        end = np.searchsorted(index["days"], last, side="right")
+        rows = intersect(rows, np.sort(index["day_order"][start:end]))
+
+    return np.arange(index["rows"]) if rows is None else rows
+
+
+def _selection_mask(df, selection):
+    mask = np.ones(len(df), dtype=bool)
+    for field, column in INDEX_KEYS.items():
+        values = getattr(selection, field, None)
+        if values is not None:
+            mask &= df[column].isin(values).to_numpy()
+    if selection.dates is not None:
+        mask &= df["Day"].between(*selection.dates).to_numpy()
+    return mask
+
+
+def refresh_cube_view(engine):
+    query = _oee_sums_query(engine, CUBE_VIEW_KEYS)
+    sql = str(query.compile(engine, compile_kwargs={"literal_binds": True}))
+
+    with engine.begin() as conn:
+        if engine.dialect.name == "postgresql":
+            conn.execute(text(
+                f'CREATE MATERIALIZED VIEW IF NOT EXISTS "{CUBE_VIEW}" AS {sql}'
+            ))
+            conn.execute(text(f'REFRESH MATERIALIZED VIEW "{CUBE_VIEW}"'))
+        else:
+            conn.execute(text(f'DROP TABLE IF EXISTS "{CUBE_VIEW}"'))
+            conn.execute(text(f'CREATE TABLE "{CUBE_VIEW}" AS {sql}'))
+        conn.execute(text(
+            f'CREATE INDEX IF NOT EXISTS ix_{CUBE_VIEW}_month '
+            f'ON "{CUBE_VIEW}" ("MonthSort")'
+        ))
+
+
+# ===============================
+# SQL PUSH-DOWN
+# ===============================
+
+def kpi_backend():
+    # "pandas" aggregates the loaded model, "sql" runs GROUP BY in the
+    # database, "history" streams the Parquet history
+    return os.getenv("KPI_BACKEND", "pandas")
+
+
+def cube_view_enabled():
+    # SQL backend reads the pre-aggregated CUBE_VIEW instead of raw entries
+    return os.getenv("CUBE_VIEW", "0") == "1"
+
+
+def _month_label(month_sort):
+    dates = pd.to_datetime(month_sort.astype(str), format="%Y%m")
+    return (
+        dates.dt.month_name(locale="en_US.utf8") + " " +
+        dates.dt.year.astype(str)
+    )
+
+
+def _entry_sums(engine):
+    # Per-entry measures over the raw tables
+    dialect = engine.dialect.name
+    entries = reflect_table(engine, "fProductionEntries")
+    orders = reflect_table(engine, "fProductionOrders")
+    product = reflect_table(engine, "dProduct")
+
+    start = timestamp_column(entries.c.StartTime, dialect)
+    end = timestamp_column(entries.c.EndTime, dialect)
+    hours = hours_between(start, end, dialect)
+    productive = entries.c.IncidentID.is_(None)
+
+    source = (
+        entries
+        .outerjoin(orders, entries.c.PO_ID == orders.c.PO_ID)
+        .outerjoin(product, orders.c.ProductID == product.c.ProductID)
+    )
+
+    columns = {
+        "MonthSort": month_sort(start, dialect),
+        "Day": day_of(start, dialect),
+        "MachineID": entries.c.MachineID,
+        "OperatorID": entries.c.OperatorID,
+        "IncidentID": entries.c.IncidentID,
+    }
+
+    measures = [
+        func.sum(case((productive, hours), else_=0)).label("total_hours"),
+        func.sum(case((productive, 0), else_=hours)).label("outage_hours"),
+        func.sum(
+            case((productive, product.c.ItemsPerHour * hours), else_=0)
+        ).label("qty_planned"),
+        func.sum(entries.c.QtyProduced).label("qty_produced"),
+        func.sum(entries.c.QtyRejected).label("qty_rejected"),
+    ]
+
+    def selection_filter(selection):
+        conditions = []
+        if selection.months is not None:
+            conditions.append(months_predicate(entries.c.StartTime, selection.months, dialect))
+        if selection.dates is not None:
+            first, last = selection.dates
+            conditions += [
+                start >= timestamp_value(first, entries.c.StartTime, dialect),
+                start < timestamp_value(last + pd.Timedelta(days=1), entries.c.StartTime, dialect),
+            ]
+        return conditions
+
+    return entries, source, columns, measures, selection_filter
+
+
+def _cube_sums(engine):
+    # Same shape as _entry_sums, read from the pre-aggregated cube view
+    cube = reflect_table(engine, CUBE_VIEW)
+    columns = {key: cube.c[key] for key in CUBE_VIEW_KEYS}
+    measures = [func.sum(cube.c[measure]).label(measure) for measure in MEASURES]
+
+    def selection_filter(selection):
+        conditions = []
+        if selection.months is not None:
+            conditions.append(cube.c.MonthSort.in_(selection.months))
+        if selection.dates is not None:
+            first, last = selection.dates
+            conditions.append(cube.c.Day.between(
+                _day_value(first, engine.dialect.name),
+                _day_value(last, engine.dialect.name)
+            ))
+        return conditions
+
+    return cube, cube, columns, measures, selection_filter
+
+
+def _day_value(day, dialect):
+    # Day is func.date() text on SQLite, a truncated timestamp on PostgreSQL
+    if dialect == "sqlite":
+        return day.strftime("%Y-%m-%d")
+    return day.to_pydatetime()
+
+
+def _oee_sums_query(engine, keys, selection=None, from_cube=False):
+    if from_cube:
+        facts, source, columns, measures, selection_filter = _cube_sums(engine)
+    else:
+        facts, source, columns, measures, selection_filter = _entry_sums(engine)
+
+    # Dimension labels, joined only when asked for
+    for table_name, key, label in [
+        ("dMachine", "MachineID", "Machine"),
+        ("dOperator", "OperatorID", "Operator"),
+        ("dIncident", "IncidentID", "Incident"),
+    ]:
+        if label in keys:
+            dim = reflect_table(engine, table_name)
+            source = source.outerjoin(dim, facts.c[key] == dim.c[key])
+            columns[label] = dim.c[label]
+
+    group = [columns[key].label(key) for key in keys]
+    query = select(*group, *measures).select_from(source)
+
+    if group:
+        query = query.group_by(*[columns[key] for key in keys])
+    if selection is not None:
+        conditions = selection_filter(selection)
+        if selection.machines is not None:
+            conditions.append(facts.c.MachineID.in_(selection.machines))
+        if selection.operators is not None:
+            conditions.append(facts.c.OperatorID.in_(selection.operators))
+        query = query.where(*conditions)
+
+    return query
+
+
+@cache_data(max_entries=256)
+def calculate_oee_grouped_sql(dims, selection=None, version=0):
+    # Same result as calculate_oee_grouped, computed by the database.
+    # version is only part of the cache key; results of older versions are
+    # never asked for again and age out of the bounded cache.
+    keys = _dimension_keys(dims)
+    sql_keys = [key for key in keys if key != "MonthLabel"]
+    if "MonthLabel" in keys and "MonthSort" not in sql_keys:
+        sql_keys.append("MonthSort")
+
+    engine = get_engine()
+    query = _oee_sums_query(engine, sql_keys, selection, cube_view_enabled())
+    with span(f"calculate_oee_grouped_sql[{','.join(dims)}]"):
+        sums = pd.read_sql(query, engine)
+
+    # groupby drops missing keys, so does the pandas backend
+    sums = sums.dropna(subset=sql_keys)
+    sums[MEASURES] = sums[MEASURES].astype(float).fillna(0)
+    if "Day" in keys:
+        sums["Day"] = pd.to_datetime(sums["Day"])
+    if "MonthLabel" in keys:
+        sums["MonthLabel"] = _month_label(sums["MonthSort"])
+
+    return _oee_ratios(sums[keys + MEASURES].reset_index(drop=True))
+
+
+@cache_data(max_entries=256)
+@timed()
+def calculate_oee_sql(selection=None, version=0):
+    engine = get_engine()
+    query = _oee_sums_query(engine, [], selection, cube_view_enabled())
+    sums = pd.read_sql(query, engine)
+    sums = sums.astype(float).fillna(0)
+    return _metrics_dict(_oee_ratios(sums).iloc[0])
+
+
+# ===============================
+# HISTORY BACKEND
+# ===============================
+
+# KPI_BACKEND=history keeps fProductionEntries as month-partitioned Parquet
+# on local disk (utils.history), appended to from the database. A query
+# opens only the months its selection covers, one at a time, reduces each
+# to partial sums and adds those up, so the full history is never in
+# memory. Dimensions and orders are still loaded whole.
+#
+# Syncs run one at a time under the store's lock, whether they come from the
+# first load, the background thread or a refresh on the script thread: two
+# at once would append the same rows twice, or remove a staging directory
+# the other one is still writing.
+
+@cache_resource
+def _history_store():
+    return {"synced": False, "lock": threading.RLock()}
+
+
+def _history_overlap(engine, watermark):
+    # Entries of the overlap window before the watermark that the history
+    # does not hold yet (see INCREMENTAL_KEYS)
+    start = watermark - incremental_overlap()
+    after_start = _newer(engine, "StartTime", start)
+    after_watermark = _newer(engine, "StartTime", watermark)
+    rows = read_table(
+        engine,
+        "fProductionEntries",
+        where=lambda table: and_(after_start(table), ~after_watermark(table))
+    )
+    if rows.empty:
+        return rows
+
+    months = {
+        period.year * 100 + period.month
+        for period in pd.period_range(start, watermark, freq="M")
+    }
+    seen = [
+        history.read_partition(files) for files in history.partitions(months).values()
+    ]
+    seen = pd.concat([part[part["StartTime"] > start] for part in seen] or [rows.iloc[:0]])
+    return _unseen_rows(rows, seen[rows.columns])
+
+
+@timed()
+def sync_history(full=False):
+    # Streams entries past the history's watermark into their months, in
+    # StartTime order so an interrupted sync resumes where it stopped. A
+    # full sync is built next to the live history and swapped in.
+    with _history_store()["lock"]:
+        _sync_history(get_engine(), full)
+
+
+def _sync_history(engine, full):
+    root = history.staging_dir() if full else history.HISTORY_DIR
+    meta = None if full else history.read_meta()
+    watermark = meta["watermark"] if meta else None
+
+    if watermark is not None:
+        # Appending them again later finds them in the history
+        late = _history_overlap(engine, watermark)
+        if not late.empty:
+            history.append(late, root)
+
+    where = None if watermark is None else _newer(engine, "StartTime", watermark)
+    chunks = iter_table(
+        engine,
+        "fProductionEntries",
+        where=where,
+        order_by=lambda table: timestamp_column(table.c.StartTime, engine.dialect.name)
+    )
+    for chunk in chunks:
+        # Nothing new still comes back as one empty chunk
+        if chunk.empty:
+            continue
+        history.append(chunk, root)
+        latest = chunk["StartTime"].max()
+        if pd.notna(latest):
+            watermark = latest
+        history.write_meta(watermark, root)
+    history.write_meta(watermark, root)
+
+    if full:
+        history.swap_in(root)
+
+
+def ensure_history():
+    # Once per process: catch up with the database, or build the history
+    # when there is none. Offline, an existing history is used as is.
+    store = _history_store()
+    with store["lock"]:
+        if not store["synced"]:
+            meta = history.read_meta()
+            try:
+                sync_history(full=meta is None)
+                refreshed_at = time.time()
+            except SQLAlchemyError:
+                if meta is None:
+                    raise
+                refreshed_at = meta["synced_at"]
+            with _model_store()["lock"]:
+                _model_store()["refreshed_at"] = refreshed_at
+            store["synced"] = True
+
+    if refresh_interval() > 0:
+        _refresh_worker()
+
+
+def _refresh_history(store, full=False):
+    with _history_store()["lock"]:
+        sync_history(full)
+        _reload_dimensions()
+    with store["lock"]:
+        store["version"] += 1
+        store["refreshed_at"] = time.time()
+
+
+def _selection_months(selection):
+    # MonthSort values a selection covers: the selected months, narrowed
+    # to the date range; None for every month
+    if selection is None:
+        return None
+    months = selection.months
+    if selection.dates is not None:
+        in_range = {
+            period.year * 100 + period.month
+            for period in pd.period_range(*selection.dates, freq="M")
+        }
+        months = in_range if months is None else in_range & set(months)
+    return months
+
+
+@cache_data(max_entries=4096)
+def _partition_sums(files, keys, selection=None, version=0, kind=None):
+    # Measure sums of one month by keys, prorated over a bucket kind when
+    # given. files name the month's contents, version the dimensions it was
+    # enriched with.
+    model = build_model({
+        **load_dimensions(),
+        "fProductionEntries": history.read_partition(files),
+    })
+    if kind is not None:
+        model = build_bucket_cube(model, kind)
+    if selection is not None:
+        model = model[_selection_mask(model, selection)]
+
+    measures = _oee_measures(model)
+    if not keys:
+        return measures.sum().to_frame().T
+    return measures.groupby(
+        [model[key] for key in keys],
+        observed=True
+    ).sum().reset_index()
+
+
+def _history_sums(keys, selection, kind=None):
+    ensure_history()
+    months = _selection_months(selection)
+    rest = None
+    if kind is not None:
+        # Pieces can fall in a later month than their partition
+        months = _with_previous_months(months)
+        rest = selection
+    elif selection is not None:
+        rest = make_selection(**selection._replace(months=None)._asdict())
+
+    parts = []
+    for month, files in history.partitions(months).items():
+        try:
+            parts.append(_partition_sums(files, tuple(keys), rest, data_version(), kind))
+        except FileNotFoundError:
+            # Compacted by a sync meanwhile, list the month again
+            files = history.partitions({month}).get(month)
+            if files:
+                parts.append(_partition_sums(files, tuple(keys), rest, data_version(), kind))
+
+    parts = [part for part in parts if not part.empty]
+    if not parts:
+        # Nothing matched: sums of an empty month, with the key columns
+        # typed like real results
+        return _partition_sums((), tuple(keys), rest, data_version(), kind)
+    return concat_models(parts)
+
+
+@cache_data(max_entries=256)
+def calculate_oee_grouped_history(dims, selection=None, version=0):
+    # Same result as calculate_oee_grouped over the history's partial sums.
+    # version is only part of the cache key, bounded like the sql backend's.
+    keys = _dimension_keys(dims)
+    with span(f"calculate_oee_grouped_history[{','.join(dims)}]"):
+        sums = _history_sums(keys, selection)
+    return calculate_oee_grouped(sums, list(dims))
+
+
+@cache_data(max_entries=256)
+@timed()
+def calculate_oee_history(selection=None, version=0):
+    return calculate_oee(_history_sums([], selection))
+
+
+@cache_data(max_entries=256)
+def calculate_oee_prorated_history(dims, selection=None, version=0):
+    keys = _dimension_keys(dims)
+    with span(f"calculate_oee_prorated_history[{','.join(dims)}]"):
+        sums = _history_sums(keys, selection, _bucket_kind(dims))
+    return calculate_oee_grouped(sums, list(dims))
+
+
+# Entry points for the pages: df is the filtered cube (pandas backend),
+# selection the page's Selection (SQL and history backends, None for
+# everything)
+
+def oee_totals(df, selection=None):
+    if kpi_backend() == "sql":
+        return calculate_oee_sql(selection, data_version())
+    if kpi_backend() == "history":
+        return calculate_oee_history(selection, data_version())
+    return calculate_oee(df)
+
+
+def oee_grouped(df, dims, selection=None):
+    if kpi_backend() == "sql":
+        return calculate_oee_grouped_sql(tuple(dims), selection, data_version())
+    if kpi_backend() == "history":
+        return calculate_oee_grouped_history(tuple(dims), selection, data_version())
+    return calculate_oee_grouped(df, dims)
+
+
+def oee_prorated(dims, selection=None):
+    # Like oee_grouped, with entries shared out over the hours, shifts and
+    # days they span. dims can include "hour" or "shift". The pandas backend
+    # builds it from the loaded model, the SQL backend from the selected
+    # months streamed out of the database.
+    if kpi_backend() == "history":
+        return calculate_oee_prorated_history(tuple(dims), selection, data_version())
+
+    kind = _bucket_kind(dims)
+    if kpi_backend() == "sql":
+        months = _with_previous_months(_selection_months(selection))
+        cube = stream_bucket_cube(kind, months, data_version())
+    else:
+        months = None
+        if selection is not None and selection.months is not None and filter_pushdown():
+            months = _with_previous_months(selection.months)
+        cube = load_bucket_cube(kind, months, data_version())
+    if selection is not None:
+        cube = cube[_selection_mask(cube, selection)]
+    return calculate_oee_grouped(cube, list(dims))
+
+
+def month_options():
+    if kpi_backend() == "history":
+        ensure_history()
+        months = pd.DataFrame({"MonthSort": list(history.partitions())}, dtype="int64")
+        months["MonthLabel"] = _month_label(months["MonthSort"])
+        return months[["MonthLabel", "MonthSort"]]
+    if kpi_backend() == "sql" or filter_pushdown():
+        months = calculate_oee_grouped_sql(("month",), None, data_version())
+        return months[["MonthLabel", "MonthSort"]].sort_values("MonthSort")
+    return load_indexed_cube()[1]["months"]
 
-    oee = availability * productivity * quality
 
+def filter_options():
+    # Machines and operators to filter on, from the (small) dimension tables
+    dims = load_dimensions()
+    machines = dims["dMachine"][["MachineID", "Machine"]].drop_duplicates("MachineID")
+    operators = dims["dOperator"][["OperatorID", "Operator"]].drop_duplicates("OperatorID")
     return {
-        "availability": availability,
-        "productivity": productivity,
-        "quality": quality,
-        "oee": oee,
-        "qty_produced": qty_produced,
-        "qty_planned": qty_planned,
-        "qty_rejected": qty_rejected,
-        "total_hours": productive_hours,
-        "outage_hours": outage_hours,
-    }
\ No newline at end of file
+        "machines": machines.sort_values("Machine").reset_index(drop=True),
+        "operators": operators.sort_values("Operator").reset_index(drop=True),
+    }
@@ -0,0 +1,140 @@
+import os
+
+import duckdb
+import numpy as np
+
+from utils.perf import cache_resource
+
+# DuckDB implementation of the heavy frame work: the model's joins and date
+# columns, and grouped sums of the OEE measures. Frames are scanned in place
+# (no copy into DuckDB) and queries run on DUCKDB_THREADS threads. Only
+# numbers come back; utils.data_loader turns them into the same columns
+# the pandas path builds.
+
+# Below this many rows starting a query costs more than pandas needs
+MIN_ROWS = 100_000
+
+# Same expressions as data_loader._oee_measures
+MEASURE_SQL = {
+    "total_hours": "CASE WHEN IncidentID IS NULL THEN CAST(Hours AS DOUBLE) ELSE 0 END",
+    "outage_hours": "CASE WHEN IncidentID IS NULL THEN 0 ELSE CAST(Hours AS DOUBLE) END",
+    "qty_planned": (
+        "CASE WHEN IncidentID IS NULL "
+        "THEN CAST(ItemsPerHour AS DOUBLE) * CAST(Hours AS DOUBLE) ELSE 0 END"
+    ),
+    "qty_produced": "CAST(QtyProduced AS DOUBLE)",
+    "qty_rejected": "CAST(QtyRejected AS DOUBLE)",
+}
+
+
+@cache_resource
+def _database():
+    con = duckdb.connect()
+    threads = os.getenv("DUCKDB_THREADS")
+    if threads:
+        con.execute(f"SET threads = {int(threads)}")
+    return con
+
+
+def _cursor(**frames):
+    # One connection per query, sharing the database; registered frames
+    # stay private to it
+    con = _database().cursor()
+    for name, frame in frames.items():
+        con.register(name, frame)
+    return con
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def model_columns(entries, orders, products, machines, incidents, operators):
+    # Row positions into each (deduplicated) dimension, -1 when there is
+    # no match, plus the time-derived columns, in the order of entries.
+    # Dimensions come with their key column(s) only.
+    def positioned(dim):
+        return dim.assign(pos=np.arange(len(dim)))
+
+    entries = entries[[
+        "PO_ID", "MachineID", "IncidentID", "OperatorID", "StartTime", "EndTime"
+    ]].assign(row=np.arange(len(entries)))
+
+    con = _cursor(
+        entries=entries,
+        orders=positioned(orders),
+        products=positioned(products),
+        machines=positioned(machines),
+        incidents=positioned(incidents),
+        operators=positioned(operators),
+    )
+    try:
+        result = con.sql("""
+            SELECT
+                e.row,
+                coalesce(o.pos, -1) AS order_pos,
+                coalesce(p.pos, -1) AS product_pos,
+                coalesce(m.pos, -1) AS machine_pos,
+                coalesce(i.pos, -1) AS incident_pos,
+                coalesce(op.pos, -1) AS operator_pos,
+                (epoch_ns(e.EndTime) - epoch_ns(e.StartTime)) / 1e9 / 3600 AS Hours,
+                epoch_ns(date_trunc('day', e.StartTime)) AS Day,
+                year(e.StartTime) AS Year,
+                month(e.StartTime) AS MonthNumber,
+                year(e.StartTime) * 100 + month(e.StartTime) AS MonthSort
+            FROM entries e
+            LEFT JOIN orders o ON e.PO_ID = o.PO_ID
+            LEFT JOIN products p ON o.ProductID = p.ProductID
+            LEFT JOIN machines m ON e.MachineID = m.MachineID
+            LEFT JOIN incidents i ON e.IncidentID = i.IncidentID
+            LEFT JOIN operators op ON e.OperatorID = op.OperatorID
+        """).fetchnumpy()
+    finally:
+        con.close()
+
+    # Joins may hand rows back in any order, put them back in place
+    row = result.pop("row")
+    columns = {}
+    for name, values in result.items():
+        values = np.asarray(values)
+        columns[name] = np.empty(len(row), dtype=values.dtype)
+        columns[name][row] = values
+    columns["Day"] = columns["Day"].view("datetime64[ns]")
+    return columns
+
+
+def grouped_sums(df, keys, dropna=True, measures=None):
+    # {key columns, measure sums} per group, sorted like a pandas groupby
+    # with observed=True. measures are the precomputed measure columns of
+    # a cube, None to derive them from model columns.
+    if measures:
+        select = {name: _quote(name) for name in measures}
+        columns = keys + measures
+    else:
+        select = MEASURE_SQL
+        columns = keys + [
+            "IncidentID", "Hours", "ItemsPerHour", "QtyProduced", "QtyRejected"
+        ]
+
+    quoted = [_quote(key) for key in keys]
+    sums = ", ".join(
+        f"coalesce(fsum({expression}), 0) AS {name}"
+        for name, expression in select.items()
+    )
+    where = ""
+    if dropna and keys:
+        where = "WHERE " + " AND ".join(f"{key} IS NOT NULL" for key in quoted)
+    group = ""
+    if keys:
+        group = (
+            f"GROUP BY {', '.join(quoted)} "
+            f"ORDER BY {', '.join(key + ' NULLS LAST' for key in quoted)}"
+        )
+
+    con = _cursor(frame=df[list(dict.fromkeys(columns))])
+    try:
+        return con.sql(
+            f"SELECT {', '.join(quoted + [sums])} FROM frame {where} {group}"
+        ).df()
+    finally:
+        con.close()
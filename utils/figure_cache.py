@@ -0,0 +1,76 @@
+import os
+import threading
+from collections import OrderedDict
+
+import plotly.io as pio
+
+from utils.data_loader import data_version
+from utils.perf import cache_resource, record_cache
+
+# Built Plotly figures shared across sessions, keyed by page, chart, filter
+# selection and data version. Least recently used figures are dropped once
+# FIGURE_CACHE_MB is exceeded. Cached figures are shared: treat them as
+# read-only.
+
+
+def _max_bytes():
+    return float(os.getenv("FIGURE_CACHE_MB", "64")) * 2**20
+
+
+@cache_resource
+def _figure_store():
+    return {
+        "figures": OrderedDict(),
+        "bytes": 0,
+        "version": None,
+        "lock": threading.Lock(),
+    }
+
+
+def _selection(selection):
+    # None is everything; Selections come normalized from make_selection
+    return "all" if selection is None else selection
+
+
+def _evict(store, max_bytes):
+    while store["figures"] and store["bytes"] > max_bytes:
+        _, (_, size) = store["figures"].popitem(last=False)
+        store["bytes"] -= size
+
+
+def cached_figure(page, chart, selection, build, extra=None):
+    # build() makes the figure on a miss; extra holds any other input the
+    # figure depends on (e.g. chart controls)
+    if os.getenv("FIGURE_CACHE", "1") != "1":
+        return build()
+
+    store = _figure_store()
+    version = data_version()
+    key = (page, chart, _selection(selection), version, extra)
+
+    with store["lock"]:
+        if store["version"] != version:
+            # Figures of older data can never be asked for again
+            store["figures"].clear()
+            store["bytes"] = 0
+            store["version"] = version
+
+        entry = store["figures"].get(key)
+        if entry is not None:
+            store["figures"].move_to_end(key)
+    record_cache("figure_cache", "figure", entry is not None)
+    if entry is not None:
+        return entry[0]
+
+    fig = build()
+    size = len(pio.to_json(fig, validate=False))
+    max_bytes = _max_bytes()
+    if size > max_bytes:
+        return fig
+
+    with store["lock"]:
+        if store["version"] == version and key not in store["figures"]:
+            store["figures"][key] = (fig, size)
+            store["bytes"] += size
+            _evict(store, max_bytes)
+    return fig
@@ -0,0 +1,117 @@
+import pandas as pd
+import streamlit as st
+
+from utils.data_loader import data_status, filter_options, make_selection, month_options
+
+
+def _date_bounds(months):
+    if months.empty:
+        return None
+    first = months["MonthSort"].min()
+    last = months["MonthSort"].max()
+    return (
+        pd.Timestamp(year=first // 100, month=first % 100, day=1).date(),
+        (pd.Timestamp(year=last // 100, month=last % 100, day=1) + pd.offsets.MonthEnd(0)).date(),
+    )
+
+
+def _age_text(seconds):
+    if seconds < 60:
+        return "just now"
+    if seconds < 3600:
+        return f"{int(seconds // 60)} min ago"
+    if seconds < 2 * 86400:
+        return f"{int(seconds // 3600)} h ago"
+    return f"{int(seconds // 86400)} days ago"
+
+
+def render_data_age():
+    # How old the served data is; a background refresh swaps in new data
+    # without the page waiting for it
+    status = data_status()
+    if status["age"] is None:
+        return
+
+    text = f"🕒 Data updated {_age_text(status['age'])}"
+    if status["refreshing"]:
+        text += " · refreshing in the background"
+    elif status["error"]:
+        text += f" · last refresh failed: {status['error']}"
+    st.caption(text)
+
+
+def render_filters(key):
+    # Month / machine / operator / date range filters of a dashboard page,
+    # returned as a Selection (None when nothing is filtered)
+    months = month_options()
+    month_labels = months["MonthLabel"].tolist()
+    options = ["Select All"] + month_labels
+    choices = filter_options()
+    machines = choices["machines"]
+    operators = choices["operators"]
+
+    col1, col2, col3, col4 = st.columns(4)
+
+    with col1:
+        selected = st.multiselect(
+            "Select Month(s)",
+            options=options,
+            key=key
+        )
+    if "Select All" in selected and len(selected) > 1:
+        selected = [m for m in selected if m != "Select All"]
+        selected_months = selected
+    elif "Select All" in selected or not selected:
+        selected_months = month_labels
+    else:
+        selected_months = selected
+
+    # None means every month, no filtering needed
+    selected_sorts = None
+    if len(selected_months) < len(month_labels):
+        selected_sorts = months.loc[
+            months["MonthLabel"].isin(selected_months), "MonthSort"
+        ].tolist()
+
+    machine_names = dict(zip(machines["MachineID"], machines["Machine"]))
+    with col2:
+        selected_machines = st.multiselect(
+            "Machine(s)",
+            options=machines["MachineID"].tolist(),
+            format_func=lambda machine: f"{machine_names[machine]} ({machine})",
+            placeholder="All machines",
+            key=f"{key}_machines"
+        )
+
+    operator_names = dict(zip(operators["OperatorID"], operators["Operator"]))
+    with col3:
+        selected_operators = st.multiselect(
+            "Operator(s)",
+            options=operators["OperatorID"].tolist(),
+            format_func=lambda operator: operator_names[operator],
+            placeholder="All operators",
+            key=f"{key}_operators"
+        )
+
+    dates = None
+    bounds = _date_bounds(months)
+    if bounds is not None:
+        with col4:
+            picked = st.date_input(
+                "Date range",
+                value=bounds,
+                min_value=bounds[0],
+                max_value=bounds[1],
+                key=f"{key}_dates"
+            )
+        # Half-picked ranges and the full range filter nothing
+        if len(picked) == 2 and tuple(picked) != bounds:
+            dates = picked
+
+    render_data_age()
+    return make_selection(
+        months=selected_sorts,
+        machines=selected_machines or None,
+        operators=selected_operators or None,
+        dates=dates,
+    )
@@ -0,0 +1,155 @@
+import json
+import os
+import shutil
+import time
+import uuid
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from utils.schema import SCHEMA
+
+base_path = os.path.dirname(__file__)
+default_path = os.path.join(base_path, '..', 'data', 'history')
+
+# fProductionEntries kept on local disk as Parquet, one directory per month
+# (Year=YYYY/Month=MM), so queries only open the months they need and read
+# them one at a time. Syncs add new part files; a month with too many of
+# them is rewritten as one.
+HISTORY_DIR = Path(os.getenv("HISTORY_DIR", default_path))
+META_FILE = "meta.json"
+MAX_PART_FILES = 16
+
+ARROW_TYPES = {
+    "integer": pa.int64(),
+    "float": pa.float64(),
+    "timestamp": pa.timestamp("ns"),
+    "string": pa.string(),
+}
+
+
+def _schema():
+    # Fixed types whatever a chunk was downcast to; nullable integers are
+    # stored as floats, as pandas reads them
+    fields = []
+    for column, (kind, nullable) in SCHEMA["fProductionEntries"]["columns"].items():
+        arrow_type = ARROW_TYPES[kind]
+        if kind == "integer" and nullable:
+            arrow_type = pa.float64()
+        fields.append(pa.field(column, arrow_type))
+    return pa.schema(fields)
+
+
+def _string_columns():
+    return [
+        column for column, (kind, _) in SCHEMA["fProductionEntries"]["columns"].items()
+        if kind == "string"
+    ]
+
+
+def _month_dir(root, month_sort):
+    return root / f"Year={month_sort // 100}" / f"Month={month_sort % 100:02d}"
+
+
+def _to_arrow(df):
+    columns = {}
+    for field in _schema():
+        values = df[field.name]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            values = values.astype(object)
+        columns[field.name] = values
+    return pa.Table.from_pandas(pd.DataFrame(columns), schema=_schema(), preserve_index=False)
+
+
+def _write_part(directory, table):
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / f"part-{uuid.uuid4().hex}.parquet"
+    tmp_path = path.with_suffix(".tmp")
+    pq.write_table(table, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def _read_part(path, **kwargs):
+    # Without partitioning, Year= / Month= in the path are not read as columns
+    return pq.read_table(path, partitioning=None, **kwargs)
+
+
+def append(entries, root=None):
+    # Adds a chunk of entries (StartTime already parsed) to its months
+    root = root or HISTORY_DIR
+    month_sort = entries["StartTime"].dt.year * 100 + entries["StartTime"].dt.month
+    for month, part in entries.groupby(month_sort.to_numpy()):
+        directory = _month_dir(root, int(month))
+        _write_part(directory, _to_arrow(part))
+
+        files = sorted(directory.glob("*.parquet"))
+        if len(files) > MAX_PART_FILES:
+            _write_part(directory, pa.concat_tables([_read_part(f) for f in files]))
+            for f in files:
+                f.unlink()
+
+
+def partitions(months=None, root=None):
+    # {MonthSort: part files} on disk, only for months when given
+    root = root or HISTORY_DIR
+    found = {}
+    for directory in root.glob("Year=*/Month=*"):
+        month = int(directory.parent.name[5:]) * 100 + int(directory.name[6:])
+        if months is not None and month not in months:
+            continue
+        files = tuple(sorted(str(f) for f in directory.glob("*.parquet")))
+        if files:
+            found[month] = files
+    return dict(sorted(found.items()))
+
+
+def read_partition(files):
+    # One month of entries (none for no files); labels come back as
+    # categoricals
+    tables = [_read_part(f, read_dictionary=_string_columns()) for f in files]
+    if not tables:
+        tables = [_schema().empty_table()]
+    return pa.concat_tables(tables).to_pandas()
+
+
+def read_meta(root=None):
+    # watermark is None for an empty history
+    meta_path = (root or HISTORY_DIR) / META_FILE
+    if not meta_path.exists():
+        return None
+    with open(meta_path, "r") as f:
+        meta = json.load(f)
+    watermark = pd.Timestamp(meta["watermark"]) if meta["watermark"] else None
+    meta["watermark"] = None if pd.isna(watermark) else watermark
+    return meta
+
+
+def write_meta(watermark, root=None):
+    root = root or HISTORY_DIR
+    root.mkdir(parents=True, exist_ok=True)
+    meta = {
+        "watermark": None if pd.isna(watermark) else pd.Timestamp(watermark).isoformat(),
+        "synced_at": time.time(),
+    }
+    tmp_path = root / (META_FILE + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, root / META_FILE)
+
+
+def staging_dir():
+    # A full rebuild is written next to the live history, then swapped in
+    path = HISTORY_DIR.with_name(HISTORY_DIR.name + ".new")
+    shutil.rmtree(path, ignore_errors=True)
+    return path
+
+
+def swap_in(staging):
+    old = HISTORY_DIR.with_name(HISTORY_DIR.name + ".old")
+    shutil.rmtree(old, ignore_errors=True)
+    if HISTORY_DIR.exists():
+        os.replace(HISTORY_DIR, old)
+    os.replace(staging, HISTORY_DIR)
+    shutil.rmtree(old, ignore_errors=True)
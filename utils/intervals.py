@@ -0,0 +1,100 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+# Cuts Start/End intervals at bucket boundaries (hours, shifts, days) so
+# an entry's hours and quantities can be shared out over every bucket it
+# overlaps instead of landing on the bucket it started in. All of it is
+# array arithmetic: the pieces of every entry come out of one repeat /
+# searchsorted pass, however many entries there are.
+
+HOUR = np.int64(3600 * 10**9)
+DAY = 24 * HOUR
+
+# Shift calendar: name=start pairs in the order shifts follow each other
+# through the day. A shift runs until the next one starts; the last one
+# runs past midnight and belongs to the day it started on.
+DEFAULT_SHIFTS = "Morning=06:00,Afternoon=14:00,Night=22:00"
+
+
+def shift_calendar():
+    # [(name, start offset in ns from midnight)] from SHIFTS
+    shifts = []
+    for item in os.getenv("SHIFTS", DEFAULT_SHIFTS).split(","):
+        name, start = item.split("=")
+        offset = pd.Timedelta(start.strip() + ":00")
+        if not pd.Timedelta(0) <= offset < pd.Timedelta(days=1):
+            raise ValueError(f"Shift start out of the day: {item}")
+        shifts.append((name.strip(), np.int64(offset.value)))
+
+    offsets = [offset for _, offset in shifts]
+    if not shifts or offsets != sorted(set(offsets)):
+        raise ValueError("SHIFTS must list distinct start times in order")
+    return shifts
+
+
+def bucket_edges(kind, first, last):
+    # Sorted bucket starts (int64 ns) from before first to past last.
+    # Shift edges repeat the calendar every day, so edge i starts shift
+    # i % len(shift_calendar()).
+    first_day = first - first % DAY - DAY
+    last_day = last - last % DAY + DAY
+    if kind == "hour":
+        return np.arange(first_day, last_day + HOUR, HOUR)
+    if kind == "day":
+        return np.arange(first_day, last_day + DAY, DAY)
+    if kind == "shift":
+        offsets = np.array([offset for _, offset in shift_calendar()])
+        days = np.arange(first_day, last_day + DAY, DAY)
+        return (days[:, None] + offsets[None, :]).ravel()
+    raise ValueError(f"Unknown bucket kind: {kind}")
+
+
+def split(start, end, kind):
+    # Pieces of datetime64[ns] intervals cut at bucket edges:
+    # row (position of the interval), bucket_start (ns), shift (index into
+    # shift_calendar(), shift buckets only) and share (piece hours / interval
+    # hours, 1 for empty intervals). Intervals with a missing end, or ending
+    # before they start, are kept whole in their start bucket.
+    start = np.asarray(start, dtype="datetime64[ns]").view("int64")
+    end = np.asarray(end, dtype="datetime64[ns]").view("int64")
+    missing = np.isnat(start.view("datetime64[ns]"))
+    whole = np.isnat(end.view("datetime64[ns]")) | (end < start)
+    end = np.where(whole, start, end)
+
+    known = start[~missing]
+    if known.size == 0:
+        edges = np.zeros(2, dtype="int64")
+    else:
+        edges = bucket_edges(kind, known.min(), end[~missing].max())
+
+    first = np.searchsorted(edges, start, side="right") - 1
+    last = np.searchsorted(edges, end, side="left")
+    first = np.where(missing, 0, first)
+    counts = np.where(missing, 1, np.maximum(last - first, 1))
+
+    # Row and bucket of every piece: interval i repeated counts[i] times,
+    # walking its buckets from the first one
+    row = np.repeat(np.arange(len(start)), counts)
+    step = np.arange(len(row)) - np.repeat(np.cumsum(counts) - counts, counts)
+    bucket = first[row] + step
+
+    piece_start = np.maximum(start[row], edges[bucket])
+    piece_end = np.minimum(end[row], edges[bucket + 1])
+    duration = (end - start)[row]
+    share = np.divide(
+        piece_end - piece_start,
+        duration,
+        out=np.ones(len(row)),
+        where=(duration > 0) & ~missing[row]
+    )
+
+    pieces = {
+        "row": row,
+        "bucket_start": np.where(missing[row], start[row], edges[bucket]),
+        "share": share,
+    }
+    if kind == "shift":
+        pieces["shift"] = bucket % len(shift_calendar())
+    return pieces
@@ -0,0 +1,215 @@
+import heapq
+import itertools
+import os
+import queue
+import smtplib
+import threading
+import time
+import uuid
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+import streamlit as st
+from email_validator import EmailNotValidError, validate_email
+
+from utils.perf import cache_resource
+
+# Outbound mail queue. One worker thread per process keeps an authenticated
+# SMTP connection open between jobs, sends whatever is queued over it and
+# retries failed jobs with exponential backoff. Pages enqueue a job and
+# poll its status instead of talking SMTP in the script thread.
+MAX_ATTEMPTS = 4
+RETRY_BASE_SECONDS = 2
+BATCH_SIZE = 20
+JOB_TTL_SECONDS = 3600
+
+FINAL_STATUSES = ("sent", "failed", "invalid")
+
+
+def smtp_settings():
+    # SMTP_* variables win over the SERVER/PORT secrets; no username means
+    # no login (e.g. a local aiosmtpd stand-in with SMTP_STARTTLS=0)
+    return {
+        "host": os.getenv("SMTP_HOST") or st.secrets.get("SERVER", "localhost"),
+        "port": int(os.getenv("SMTP_PORT") or st.secrets.get("PORT", 25)),
+        "starttls": os.getenv("SMTP_STARTTLS", "1") == "1",
+        "username": os.getenv("SMTP_USERNAME") or os.getenv("SENDER"),
+        "password": os.getenv("SMTP_PASSWORD") or os.getenv("PY_NEWS"),
+        "timeout": float(os.getenv("SMTP_TIMEOUT_SECONDS", "20")),
+        "idle_seconds": float(os.getenv("SMTP_IDLE_SECONDS", "30")),
+    }
+
+
+def compose(sender, recipient, subject, body):
+    msg = MIMEMultipart()
+    msg['From'] = sender
+    msg['To'] = recipient
+    msg['Subject'] = subject
+    msg.attach(MIMEText(body, 'plain'))
+    return sender, recipient, msg.as_string()
+
+
+@cache_resource
+def _mail_store():
+    store = {
+        "queue": queue.Queue(),
+        "jobs": {},
+        "lock": threading.Lock(),
+    }
+    threading.Thread(
+        target=_worker, args=(store,), name="mailer", daemon=True
+    ).start()
+    return store
+
+
+def send_mail(messages, settings, check_address=None):
+    # messages are compose() tuples, sent in order over one connection.
+    # check_address gets the (slow, DNS based) deliverability check first.
+    store = _mail_store()
+    job = {
+        "id": uuid.uuid4().hex,
+        "status": "queued",
+        "attempts": 0,
+        "error": None,
+        "created": time.time(),
+        "messages": list(messages),
+        # Messages the server accepted, a retry resumes after them
+        "sent": 0,
+        "settings": settings,
+        "check_address": check_address,
+    }
+
+    with store["lock"]:
+        now = time.time()
+        for job_id in [
+            job_id for job_id, old in store["jobs"].items()
+            if old["status"] in FINAL_STATUSES and now - old["created"] > JOB_TTL_SECONDS
+        ]:
+            del store["jobs"][job_id]
+        store["jobs"][job["id"]] = job
+
+    store["queue"].put(job)
+    return job["id"]
+
+
+def mail_status(job_id):
+    store = _mail_store()
+    with store["lock"]:
+        job = store["jobs"].get(job_id)
+        if job is None:
+            return None
+        return {key: job[key] for key in ("status", "attempts", "error")}
+
+
+def _set(store, job, **values):
+    with store["lock"]:
+        job.update(values)
+
+
+# ===============================
+# WORKER
+# ===============================
+
+def _connect(settings):
+    server = smtplib.SMTP(settings["host"], settings["port"], timeout=settings["timeout"])
+    if settings["starttls"]:
+        server.starttls()
+    if settings["username"]:
+        server.login(settings["username"], settings["password"])
+    return server
+
+
+def _close(server):
+    try:
+        server.quit()
+    except (smtplib.SMTPException, OSError):
+        server.close()
+
+
+def _deliver(store, connections, job):
+    # Reuses the open connection for these settings, reconnects once if the
+    # server dropped it meanwhile. Messages already accepted are not sent
+    # again.
+    key = tuple(sorted((k, v) for k, v in job["settings"].items() if k != "password"))
+    for reconnect in (False, True):
+        server = connections.get(key)
+        if server is None:
+            server = connections[key] = _connect(job["settings"])
+        try:
+            for sender, recipient, body in job["messages"][job["sent"]:]:
+                server.sendmail(sender, recipient, body)
+                _set(store, job, sent=job["sent"] + 1)
+            return
+        except smtplib.SMTPServerDisconnected:
+            connections.pop(key, None)
+            if reconnect:
+                raise
+
+
+def _process(store, connections, retries, counter, job):
+    if job["check_address"] and job["attempts"] == 0:
+        try:
+            validate_email(job["check_address"], check_deliverability=True)
+        except EmailNotValidError as e:
+            _set(store, job, status="invalid", error=str(e))
+            return
+
+    _set(store, job, status="sending", attempts=job["attempts"] + 1)
+    try:
+        _deliver(store, connections, job)
+    except smtplib.SMTPRecipientsRefused as e:
+        _set(store, job, status="failed", error=str(e))
+    except (smtplib.SMTPException, OSError) as e:
+        for server in connections.values():
+            _close(server)
+        connections.clear()
+
+        if job["attempts"] >= MAX_ATTEMPTS:
+            _set(store, job, status="failed", error=str(e))
+            return
+        _set(store, job, status="retrying", error=str(e))
+        ready = time.monotonic() + RETRY_BASE_SECONDS * 2 ** (job["attempts"] - 1)
+        heapq.heappush(retries, (ready, next(counter), job))
+    else:
+        _set(store, job, status="sent", error=None)
+
+
+def _worker(store):
+    connections = {}
+    retries = []
+    counter = itertools.count()
+    idle_since = time.monotonic()
+    idle_limit = 30.0
+
+    while True:
+        # Wait for new jobs, but not past the next retry
+        timeout = 1.0
+        if retries:
+            timeout = max(0.0, min(timeout, retries[0][0] - time.monotonic()))
+
+        batch = []
+        try:
+            batch.append(store["queue"].get(timeout=timeout))
+            while len(batch) < BATCH_SIZE:
+                batch.append(store["queue"].get_nowait())
+        except queue.Empty:
+            pass
+
+        while retries and retries[0][0] <= time.monotonic() and len(batch) < BATCH_SIZE:
+            batch.append(heapq.heappop(retries)[2])
+
+        for job in batch:
+            try:
+                _process(store, connections, retries, counter, job)
+            except Exception as e:
+                # Never let one job kill the worker
+                _set(store, job, status="failed", error=str(e))
+
+        # Servers drop idle connections anyway, close them first
+        if batch:
+            idle_since = time.monotonic()
+            idle_limit = batch[-1]["settings"]["idle_seconds"]
+        elif connections and time.monotonic() - idle_since > idle_limit:
+            for server in connections.values():
+                _close(server)
+            connections.clear()
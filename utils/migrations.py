@@ -0,0 +1,68 @@
+from sqlalchemy import DateTime, text
+
+from utils.data_loader import get_engine, refresh_cube_view
+from utils.sql import reflect_table
+
+# Indexes used by the month filter push-down and the machine breakdowns.
+# Run once per database:
+#   python -m utils.migrations [--convert-timestamps] [--cube-view]
+INDEXES = {
+    "ix_entries_start_time": ("fProductionEntries", "StartTime"),
+    "ix_entries_machine_id": ("fProductionEntries", "MachineID"),
+}
+
+SQLITE_START_TIME = (
+    "substr(\"StartTime\", 7, 4) || '-' || substr(\"StartTime\", 4, 2) || '-' || "
+    "substr(\"StartTime\", 1, 2) || ' ' || substr(\"StartTime\", 12, 8)"
+)
+
+
+def convert_timestamps(engine):
+    # Turn the dd-mm-yyyy text columns into native timestamps (PostgreSQL).
+    # Without it, range predicates on StartTime cannot use an index there.
+    entries = reflect_table(engine, "fProductionEntries")
+
+    with engine.begin() as conn:
+        for column in ("StartTime", "EndTime"):
+            if isinstance(entries.c[column].type, DateTime):
+                continue
+            conn.execute(text(
+                f'ALTER TABLE "fProductionEntries" ALTER COLUMN "{column}" '
+                f'TYPE timestamp USING to_timestamp("{column}", '
+                f"'DD-MM-YYYY HH24:MI:SS')"
+            ))
+
+
+def create_indexes(engine=None, convert=False):
+    engine = engine or get_engine()
+    dialect = engine.dialect.name
+
+    if convert and dialect == "postgresql":
+        convert_timestamps(engine)
+
+    entries = reflect_table(engine, "fProductionEntries")
+    text_start_time = not isinstance(entries.c["StartTime"].type, DateTime)
+
+    with engine.begin() as conn:
+        for name, (table, column) in INDEXES.items():
+            target = f'"{column}"'
+            # SQLite can index the converted expression the queries filter on
+            if column == "StartTime" and text_start_time and dialect == "sqlite":
+                target = f"({SQLITE_START_TIME})"
+            conn.execute(text(
+                f'CREATE INDEX IF NOT EXISTS {name} ON "{table}" ({target})'
+            ))
+
+
+def create_cube_view(engine=None):
+    # Pre-aggregated cube for KPI_BACKEND=sql with CUBE_VIEW=1. Refresh Data
+    # and Full Reload refresh it afterwards.
+    refresh_cube_view(engine or get_engine())
+
+
+if __name__ == "__main__":
+    import sys
+
+    create_indexes(convert="--convert-timestamps" in sys.argv)
+    if "--cube-view" in sys.argv:
+        create_cube_view()
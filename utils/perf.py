@@ -0,0 +1,286 @@
+import functools
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import pandas as pd
+import streamlit as st
+
+# Process-wide timings of the hot paths and hit/miss counts of the cached
+# functions, shown in the admin sidebar and exported in Prometheus format.
+# Memory is traced with tracemalloc, which slows everything down: off unless
+# PERF_TRACE_MEMORY=1 or switched on from the admin panel. With several
+# sessions running at once the memory peaks overlap.
+_lock = threading.Lock()
+_spans = {}
+_caches = {}
+_tables = {}
+_local = threading.local()
+
+METRICS_FILE = os.getenv("PERF_METRICS_FILE")
+
+
+def perf_enabled():
+    return os.getenv("PERF_ENABLED", "1") == "1"
+
+
+def memory_tracing():
+    return tracemalloc.is_tracing()
+
+
+def set_memory_tracing(enabled):
+    if enabled and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    elif not enabled and tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+if os.getenv("PERF_TRACE_MEMORY", "0") == "1":
+    set_memory_tracing(True)
+
+
+def _record(name, seconds, peak_bytes):
+    with _lock:
+        stats = _spans.setdefault(name, {
+            "calls": 0,
+            "total_seconds": 0.0,
+            "max_seconds": 0.0,
+            "last_seconds": 0.0,
+            "peak_bytes": None,
+        })
+        stats["calls"] += 1
+        stats["total_seconds"] += seconds
+        stats["max_seconds"] = max(stats["max_seconds"], seconds)
+        stats["last_seconds"] = seconds
+        if peak_bytes is not None:
+            stats["peak_bytes"] = max(stats["peak_bytes"] or 0, peak_bytes)
+
+
+@contextmanager
+def span(name):
+    if not perf_enabled():
+        yield
+        return
+
+    # Nested spans reset the tracemalloc peak, so the enclosing span keeps
+    # the highest peak seen before each reset
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+
+    frame = {"start_bytes": None, "peak_bytes": 0}
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        if stack:
+            stack[-1]["peak_bytes"] = max(stack[-1]["peak_bytes"], peak)
+        tracemalloc.reset_peak()
+        frame["start_bytes"] = current
+
+    stack.append(frame)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        stack.pop()
+
+        peak_bytes = None
+        if frame["start_bytes"] is not None and tracemalloc.is_tracing():
+            peak = max(frame["peak_bytes"], tracemalloc.get_traced_memory()[1])
+            peak_bytes = peak - frame["start_bytes"]
+            if stack:
+                stack[-1]["peak_bytes"] = max(stack[-1]["peak_bytes"], peak)
+
+        _record(name, seconds, peak_bytes)
+
+
+def timed(name=None):
+    def decorate(func):
+        label = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(label):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def plotly_chart(fig, name=None, **kwargs):
+    # st.plotly_chart serializes the whole figure; spans are named after
+    # the chart title unless given a name
+    name = name or fig.layout.title.text or "untitled"
+    with span(f"plotly_chart[{name}]"):
+        return st.plotly_chart(fig, **kwargs)
+
+
+# ===============================
+# CACHE COUNTERS
+# ===============================
+
+def _count(name, kind, counter):
+    with _lock:
+        stats = _caches.setdefault(name, {"kind": kind, "calls": 0, "misses": 0})
+        stats[counter] += 1
+
+
+def record_cache(name, kind, hit):
+    # For caches other than Streamlit's
+    _count(name, kind, "calls")
+    if not hit:
+        _count(name, kind, "misses")
+
+
+def _counted_cache(decorator, kind, func, kwargs):
+    # Calls are counted around the cached function, misses inside it, where
+    # only cache misses get to. Streamlit keys the cache on the wrapped
+    # function's source and qualname, which functools.wraps keeps.
+    def decorate(func):
+        name = func.__qualname__
+
+        @functools.wraps(func)
+        def miss(*args, **kwargs):
+            _count(name, kind, "misses")
+            return func(*args, **kwargs)
+
+        cached = decorator(**kwargs)(miss)
+
+        @functools.wraps(func)
+        def call(*args, **kwargs):
+            _count(name, kind, "calls")
+            return cached(*args, **kwargs)
+
+        call.clear = cached.clear
+        return call
+
+    return decorate(func) if func is not None else decorate
+
+
+def cache_data(func=None, **kwargs):
+    return _counted_cache(st.cache_data, "data", func, kwargs)
+
+
+def cache_resource(func=None, **kwargs):
+    return _counted_cache(st.cache_resource, "resource", func, kwargs)
+
+
+# ===============================
+# TABLE MEMORY
+# ===============================
+
+def record_table_memory(name, rows, raw_bytes, compacted_bytes):
+    # In-memory size of a table as read from the database and once its
+    # dtypes are compacted, from its last full read. Reads are rare, so
+    # reset() keeps these.
+    with _lock:
+        _tables[name] = {
+            "rows": rows,
+            "raw_bytes": raw_bytes,
+            "compacted_bytes": compacted_bytes,
+        }
+
+
+# ===============================
+# REPORTS
+# ===============================
+
+def span_report():
+    with _lock:
+        rows = [{"span": name, **stats} for name, stats in _spans.items()]
+
+    report = pd.DataFrame(rows, columns=[
+        "span", "calls", "total_seconds", "max_seconds", "last_seconds", "peak_bytes"
+    ])
+    report["mean_seconds"] = report["total_seconds"] / report["calls"]
+    report["peak_mb"] = report["peak_bytes"].astype(float) / 2**20
+    return report.drop(columns="peak_bytes").sort_values("total_seconds", ascending=False)
+
+
+def cache_report():
+    with _lock:
+        rows = [{"function": name, **stats} for name, stats in _caches.items()]
+
+    report = pd.DataFrame(rows, columns=["function", "kind", "calls", "misses"])
+    report["hits"] = report["calls"] - report["misses"]
+    report["hit_rate"] = report["hits"] / report["calls"].where(report["calls"] > 0)
+    return report.sort_values("calls", ascending=False)
+
+
+def table_memory_report():
+    with _lock:
+        rows = [{"table": name, **stats} for name, stats in _tables.items()]
+
+    report = pd.DataFrame(rows, columns=["table", "rows", "raw_bytes", "compacted_bytes"])
+    report["raw_mb"] = report["raw_bytes"].astype(float) / 2**20
+    report["compacted_mb"] = report["compacted_bytes"].astype(float) / 2**20
+    report["saved"] = 1 - report["compacted_mb"] / report["raw_mb"].where(report["raw_mb"] > 0)
+    return report.drop(columns=["raw_bytes", "compacted_bytes"]).sort_values(
+        "raw_mb", ascending=False
+    )
+
+
+def reset():
+    with _lock:
+        _spans.clear()
+        _caches.clear()
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+
+def prometheus_text():
+    with _lock:
+        spans = {name: dict(stats) for name, stats in _spans.items()}
+        caches = {name: dict(stats) for name, stats in _caches.items()}
+        tables = {name: dict(stats) for name, stats in _tables.items()}
+
+    metrics = [
+        ("oee_span_calls_total", "counter", "Completed spans", "calls"),
+        ("oee_span_seconds_total", "counter", "Wall time spent in the span", "total_seconds"),
+        ("oee_span_seconds_max", "gauge", "Slowest run of the span", "max_seconds"),
+        ("oee_span_peak_bytes", "gauge", "Highest traced memory peak of the span", "peak_bytes"),
+    ]
+
+    lines = []
+    for metric, kind, help_text, field in metrics:
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} {kind}")
+        for name, stats in sorted(spans.items()):
+            if stats[field] is not None:
+                lines.append(f'{metric}{{span="{_label(name)}"}} {stats[field]}')
+
+    for metric, help_text, value in [
+        ("oee_cache_calls_total", "Calls to a cached function", lambda s: s["calls"]),
+        ("oee_cache_misses_total", "Calls that ran the cached function", lambda s: s["misses"]),
+        ("oee_cache_hits_total", "Calls answered from the cache", lambda s: s["calls"] - s["misses"]),
+    ]:
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} counter")
+        for name, stats in sorted(caches.items()):
+            lines.append(
+                f'{metric}{{function="{_label(name)}",cache="{stats["kind"]}"}} {value(stats)}'
+            )
+
+    for metric, help_text, field in [
+        ("oee_table_raw_bytes", "Table size as read from the database", "raw_bytes"),
+        ("oee_table_compacted_bytes", "Table size after dtype compaction", "compacted_bytes"),
+    ]:
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} gauge")
+        for name, stats in sorted(tables.items()):
+            lines.append(f'{metric}{{table="{_label(name)}"}} {stats[field]}')
+
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics_file(path=METRICS_FILE):
+    # For node_exporter's textfile collector; replaced atomically
+    if not path:
+        return
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(prometheus_text())
+    os.replace(tmp_path, path)
@@ -0,0 +1,170 @@
+import pandas as pd
+from sqlalchemy import BigInteger, Float, Integer, cast, select
+
+from utils.sql import reflect_table, timestamp_column
+
+# Contract for every table the dashboard reads: column -> (type, nullable),
+# plus the key columns. Types are cast in the SELECT, so pandas receives
+# native timestamps and numbers; text timestamps must use TIMESTAMP_FORMAT.
+SCHEMA = {
+    "dProduct": {
+        "key": ["ProductID"],
+        "columns": {
+            "ProductID": ("string", False),
+            "Description": ("string", True),
+            "ItemsPerHour": ("float", True),
+        },
+    },
+    "dMachine": {
+        "key": ["MachineID"],
+        "columns": {
+            "MachineID": ("string", False),
+            "Machine": ("string", False),
+        },
+    },
+    "dOperator": {
+        "key": ["OperatorID"],
+        "columns": {
+            "OperatorID": ("integer", False),
+            "Operator": ("string", False),
+        },
+    },
+    "dIncident": {
+        "key": ["IncidentID"],
+        "columns": {
+            "IncidentID": ("integer", False),
+            "Incident": ("string", False),
+            "Type": ("string", True),
+        },
+    },
+    "fProductionOrders": {
+        "key": ["PO_ID"],
+        "columns": {
+            "PO_ID": ("integer", False),
+            "IssueDate": ("timestamp", True),
+            "PlannedDeliveryDate": ("timestamp", True),
+            "ProductID": ("string", False),
+            "QtyOrdered": ("integer", True),
+        },
+    },
+    "fProductionEntries": {
+        "key": [],
+        "columns": {
+            "PO_ID": ("integer", False),
+            "OperatorID": ("integer", False),
+            "IncidentID": ("integer", True),
+            "MachineID": ("string", True),
+            "StartTime": ("timestamp", False),
+            "EndTime": ("timestamp", False),
+            "QtyProduced": ("float", True),
+            "QtyRejected": ("integer", True),
+        },
+    },
+}
+
+# Columns build_model cannot do without; other contract columns missing
+# are only reported as warnings
+REQUIRED_COLUMNS = {
+    "dProduct": ["ProductID", "ItemsPerHour"],
+    "dMachine": ["MachineID", "Machine"],
+    "dOperator": ["OperatorID", "Operator"],
+    "dIncident": ["IncidentID", "Incident"],
+    "fProductionOrders": ["PO_ID", "ProductID"],
+    "fProductionEntries": list(SCHEMA["fProductionEntries"]["columns"]),
+}
+
+DTYPE_CHECKS = {
+    "integer": pd.api.types.is_numeric_dtype,
+    "float": pd.api.types.is_numeric_dtype,
+    "timestamp": pd.api.types.is_datetime64_any_dtype,
+    "string": lambda s: not pd.api.types.is_numeric_dtype(s),
+}
+
+
+class SchemaError(Exception):
+
+    def __init__(self, issues):
+        super().__init__(f"{len(issues)} schema violation(s)")
+        self.issues = issues
+
+
+def _typed_column(column, kind, dialect):
+    if kind == "timestamp":
+        return timestamp_column(column, dialect)
+    if kind == "integer" and not isinstance(column.type, Integer):
+        return cast(column, BigInteger)
+    if kind == "float" and not isinstance(column.type, Float):
+        # Also covers NUMERIC, which would come back as Decimal objects
+        return cast(column, Float)
+    return column
+
+
+def typed_select(engine, name):
+    # SELECT with the contract's casts; unknown tables and extra columns
+    # pass through untouched, missing columns are left to validate_tables
+    table = reflect_table(engine, name)
+    contract = SCHEMA.get(name, {}).get("columns", {})
+    dialect = engine.dialect.name
+
+    columns = []
+    for column in table.columns:
+        if column.name in contract:
+            kind = contract[column.name][0]
+            column = _typed_column(column, kind, dialect).label(column.name)
+        columns.append(column)
+
+    return table, select(*columns)
+
+
+def timestamp_columns(name):
+    contract = SCHEMA.get(name, {}).get("columns", {})
+    return [
+        column for column, (kind, _) in contract.items()
+        if kind == "timestamp"
+    ]
+
+
+def validate_tables(tables, required=REQUIRED_COLUMNS):
+    # One row per violation; "error" rows would break the model build.
+    # required maps the tables that must be present to their needed columns.
+    issues = []
+
+    def issue(severity, table, column, check, detail):
+        issues.append({
+            "severity": severity,
+            "table": table,
+            "column": column,
+            "check": check,
+            "detail": detail,
+        })
+
+    for name in required:
+        if name not in tables:
+            issue("error", name, None, "missing table", "table not found")
+
+    for name, df in tables.items():
+        if name not in SCHEMA:
+            continue
+        contract = SCHEMA[name]
+
+        for column, (kind, nullable) in contract["columns"].items():
+            if column not in df:
+                severity = "error" if column in required.get(name, []) else "warning"
+                issue(severity, name, column, "missing column", f"expected {kind}")
+                continue
+
+            values = df[column]
+            if values.notna().any() and not DTYPE_CHECKS[kind](values):
+                issue("error", name, column, "type", f"expected {kind}, got {values.dtype}")
+
+            nulls = int(values.isna().sum())
+            if nulls and not nullable:
+                issue("warning", name, column, "nulls", f"{nulls} NULL value(s)")
+
+        key = [column for column in contract["key"] if column in df]
+        if key and len(key) == len(contract["key"]):
+            duplicates = int(df.duplicated(key).sum())
+            if duplicates:
+                issue("warning", name, ", ".join(key), "duplicate key", f"{duplicates} duplicate row(s)")
+
+    return issues
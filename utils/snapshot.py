@@ -0,0 +1,84 @@
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.feather as feather
+
+base_path = os.path.dirname(__file__)
+default_path = os.path.join(base_path, '..', 'data', 'snapshot')
+
+# Local Arrow IPC copy of the loaded tables and the built model. Files are
+# written uncompressed so they can be memory-mapped on startup.
+SNAPSHOT_DIR = Path(os.getenv("SNAPSHOT_DIR", default_path))
+META_FILE = "meta.json"
+MODEL_NAME = "_model"
+
+
+def snapshot_enabled():
+    return os.getenv("SNAPSHOT_ENABLED", "1") == "1"
+
+
+def _write_frame(df, path):
+    tmp_path = path.with_suffix(".tmp")
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    feather.write_feather(table, tmp_path, compression="uncompressed")
+    os.replace(tmp_path, path)
+
+
+def _read_frame(path):
+    # The map stays open for as long as Arrow buffers reference it
+    source = pa.memory_map(str(path), "r")
+    return pa.ipc.open_file(source).read_all().to_pandas()
+
+
+def write_snapshot(tables, model, fingerprint):
+    SNAPSHOT_DIR.mkdir(parents=True, exist_ok=True)
+
+    # The meta file goes last and is removed first, so a half-written
+    # snapshot is never picked up
+    meta_path = SNAPSHOT_DIR / META_FILE
+    meta_path.unlink(missing_ok=True)
+
+    for name, df in tables.items():
+        _write_frame(df, SNAPSHOT_DIR / f"{name}.arrow")
+    _write_frame(model, SNAPSHOT_DIR / f"{MODEL_NAME}.arrow")
+
+    meta = {
+        "fingerprint": fingerprint,
+        "tables": sorted(tables),
+        "written_at": time.time(),
+    }
+    with open(meta_path, "w") as f:
+        json.dump(meta, f)
+
+
+def read_snapshot():
+    meta_path = SNAPSHOT_DIR / META_FILE
+    if not meta_path.exists():
+        return None
+
+    with open(meta_path, "r") as f:
+        meta = json.load(f)
+
+    try:
+        tables = {
+            name: _read_frame(SNAPSHOT_DIR / f"{name}.arrow")
+            for name in meta["tables"]
+        }
+        model = _read_frame(SNAPSHOT_DIR / f"{MODEL_NAME}.arrow")
+    except (OSError, pa.ArrowInvalid):
+        return None
+
+    return {
+        "fingerprint": meta["fingerprint"],
+        "written_at": meta.get("written_at"),
+        "tables": tables,
+        "model": model,
+    }
+
+
+def clear_snapshot():
+    shutil.rmtree(SNAPSHOT_DIR, ignore_errors=True)
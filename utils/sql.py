@@ -0,0 +1,123 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import (
+    DateTime,
+    Float,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    and_,
+    cast,
+    false,
+    func,
+    literal,
+    literal_column,
+    or_,
+)
+
+# StartTime/EndTime are stored as "%d-%m-%Y %H:%M:%S" strings in the
+# production database. These helpers turn them into comparable timestamps
+# on the database side (PostgreSQL and the local SQLite stand-in).
+TIMESTAMP_FORMAT = "%d-%m-%Y %H:%M:%S"
+
+
+def reflect_table(engine, name):
+    return Table(name, MetaData(), autoload_with=engine)
+
+
+def timestamp_column(column, dialect):
+    if isinstance(column.type, DateTime):
+        return column
+
+    if dialect == "postgresql":
+        return cast(func.to_timestamp(column, "DD-MM-YYYY HH24:MI:SS"), DateTime)
+
+    if dialect == "sqlite":
+        # dd-mm-yyyy hh:mm:ss -> yyyy-mm-dd hh:mm:ss
+        # Constants rendered inline so the expression matches the index
+        # created by utils.migrations
+        def part(start, length):
+            return func.substr(
+                column,
+                literal_column(str(start)),
+                literal_column(str(length)),
+                type_=String
+            )
+
+        dash = literal_column("'-'", String)
+        space = literal_column("' '", String)
+        return (
+            part(7, 4) + dash + part(4, 2) + dash + part(1, 2) + space +
+            part(12, 8)
+        )
+
+    raise NotImplementedError(f"No timestamp conversion for dialect '{dialect}'")
+
+
+def timestamp_value(value, column, dialect):
+    # SQLite compares the ISO strings produced by timestamp_column
+    if dialect == "sqlite" and not isinstance(column.type, DateTime):
+        return literal(value.strftime("%Y-%m-%d %H:%M:%S"))
+    return literal(value, DateTime)
+
+
+def hours_between(start, end, dialect):
+    if dialect == "postgresql":
+        return cast(func.extract("epoch", end - start), Float) / 3600
+
+    if dialect == "sqlite":
+        return (func.julianday(end) - func.julianday(start)) * 24
+
+    raise NotImplementedError(f"No interval arithmetic for dialect '{dialect}'")
+
+
+def month_sort(timestamp, dialect):
+    # Year * 100 + month, same as the model's MonthSort
+    if dialect == "postgresql":
+        return (
+            cast(func.extract("year", timestamp), Integer) * 100 +
+            cast(func.extract("month", timestamp), Integer)
+        )
+
+    if dialect == "sqlite":
+        return cast(func.strftime("%Y%m", timestamp), Integer)
+
+    raise NotImplementedError(f"No date parts for dialect '{dialect}'")
+
+
+def day_of(timestamp, dialect):
+    if dialect == "postgresql":
+        return func.date_trunc("day", timestamp)
+
+    if dialect == "sqlite":
+        return func.date(timestamp)
+
+    raise NotImplementedError(f"No date truncation for dialect '{dialect}'")
+
+
+def month_ranges(months):
+    # MonthSort values (yyyymm) as [start, end) datetimes, consecutive months
+    # merged into a single range
+    ranges = []
+    for month in sorted(set(int(month) for month in months)):
+        start = datetime(month // 100, month % 100, 1)
+        end = (start + timedelta(days=32)).replace(day=1)
+        if ranges and ranges[-1][1] == start:
+            ranges[-1] = (ranges[-1][0], end)
+        else:
+            ranges.append((start, end))
+    return ranges
+
+
+def months_predicate(column, months, dialect):
+    # Range predicate on the timestamp itself so an index on it can be used
+    timestamp = timestamp_column(column, dialect)
+    ranges = [
+        and_(
+            timestamp >= timestamp_value(start, column, dialect),
+            timestamp < timestamp_value(end, column, dialect),
+        )
+        for start, end in month_ranges(months)
+    ]
+    return or_(*ranges) if ranges else false()